@@ -0,0 +1,187 @@
+"""Opt-in capture of the frames drawn, written to a file by a background thread"""
+
+import contextlib
+import json
+import mmap
+import queue
+import struct
+import threading
+import zlib
+import numpy as np
+import pygame as pg
+
+FORMATS = ('raw', 'zlib', 'mmap')
+POOL_SIZE = 8 # Frames that can wait to be written before frames are dropped
+ZLIB_LEVEL = 1 # Fastest compression, since the writer has to keep up with the game
+MMAP_CHUNK = 600 # Frames the memory-mapped file grows by
+LENGTH = struct.Struct('<I') # Length of each compressed frame in the zlib stream
+
+
+class FrameCapture():
+    """Copies each frame into a preallocated pool of buffers, which a
+    background thread writes to a file as raw frames, zlib compressed frames
+    or a memory-mapped file of raw frames. Frames are dropped rather than
+    waited for if the pool runs out.
+
+    The frames are written in the pixel layout of the surface, which is
+    described along with the counts of frames written and dropped in a
+    JSON file next to the frame file."""
+
+    def __init__(self, filename=None, size=(0, 0), fps=0, format='zlib', pool_size=POOL_SIZE,
+            lock=None):
+        """Initializes the capture, which is disabled unless a file is given.
+        The writer holds lock, if given, while it compresses and writes a frame."""
+        self.enabled = filename is not None
+        self.frames = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.total_depth = 0
+        if not self.enabled:
+            return
+        if format not in FORMATS:
+            raise ValueError(f'unknown capture format {format!r}, expected one of {FORMATS}')
+
+        self.filename = filename
+        self.size = size
+        self.fps = fps
+        self.format = format
+        self.lock = contextlib.nullcontext() if lock is None else lock
+        self.staging = None # 32 bit copy of surfaces with other pixel sizes
+        self.pixel_format = None
+
+        width, height = size
+        self.free = queue.SimpleQueue()
+        for _ in range(pool_size):
+            self.free.put(np.empty((height, width), np.uint32))
+        self.pending = queue.SimpleQueue()
+        self.file = open(filename, 'w+b' if format == 'mmap' else 'wb')
+        self.map = None
+        self.previous = np.zeros((height, width), np.uint32) # Last frame written
+        # A single stream keeps zlib from allocating its state for every frame
+        self.compressor = zlib.compressobj(ZLIB_LEVEL)
+        self.thread = threading.Thread(target=self.write, name='frame writer', daemon=True)
+        self.thread.start()
+
+    def capture(self, surface, block=False):
+        """Queues a copy of a surface to be written. Waits for a free buffer
+        if block is true, otherwise drops the frame if there is none."""
+        if not self.enabled:
+            return
+        try:
+            buffer = self.free.get(block)
+        except queue.Empty:
+            self.dropped += 1
+            return
+
+        if surface.get_bytesize() != 4:
+            if self.staging is None:
+                self.staging = pg.surface.Surface(self.size, 0, 32)
+            self.staging.blit(surface, (0, 0))
+            surface = self.staging
+        if self.pixel_format is None:
+            self.pixel_format = pixel_format(surface)
+        np.copyto(buffer, pg.surfarray.pixels2d(surface).T)
+
+        self.pending.put(buffer)
+        depth = self.pending.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+
+    def stop(self):
+        """Writes the frames still queued and closes the file.
+        Returns a summary of the frames written and dropped."""
+        if not self.enabled:
+            return None
+        self.pending.put(None)
+        self.thread.join()
+        if self.map is not None:
+            self.map.close()
+            # Cut off the part of the last chunk that was not written
+            self.file.truncate(self.frames * self.frame_bytes())
+        self.file.close()
+        self.enabled = False
+
+        report = self.report()
+        with open(self.filename + '.json', 'w') as file:
+            json.dump(dict(report, format=self.format, width=self.size[0], height=self.size[1],
+                    fps=self.fps, pixel_format=self.pixel_format), file, indent=1)
+        return report
+
+    def report(self):
+        """Returns the number of frames written and dropped and the depth of the queue."""
+        captured = self.frames + self.pending.qsize() if self.enabled else self.frames
+        return {
+            'frames': captured,
+            'dropped': self.dropped,
+            'max_queue_depth': self.max_depth,
+            'mean_queue_depth': round(self.total_depth / max(captured, 1), 2),
+            }
+
+    def write(self):
+        """Writes the queued frames until stopped. Runs in the writer thread."""
+        while True:
+            buffer = self.pending.get()
+            if buffer is None:
+                break
+            with self.lock:
+                self.write_frame(buffer)
+            self.frames += 1
+            self.free.put(buffer)
+
+    def write_frame(self, buffer):
+        """Writes a frame to the file."""
+        if self.format == 'raw':
+            self.file.write(buffer)
+        elif self.format == 'zlib':
+            # Only the pixels that changed since the last frame are left after
+            # xor, which compresses much faster than the background
+            np.bitwise_xor(buffer, self.previous, out=self.previous)
+            # zlib releases the GIL while compressing, so the game keeps running.
+            # Flushing ends each frame on a byte boundary of the stream.
+            data = self.compressor.compress(self.previous) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.file.write(LENGTH.pack(len(data)))
+            self.file.write(data)
+            np.copyto(self.previous, buffer)
+        else:
+            offset = self.frames * self.frame_bytes()
+            if self.map is None or offset >= len(self.map):
+                # Grow the file and map it again, since mmap cannot be
+                # resized on every platform
+                size = offset + MMAP_CHUNK * self.frame_bytes()
+                if self.map is not None:
+                    self.map.close()
+                self.file.truncate(size)
+                self.map = mmap.mmap(self.file.fileno(), size)
+            self.map[offset:offset + buffer.nbytes] = buffer.data.cast('B')
+
+    def frame_bytes(self):
+        """Returns the size of a frame in bytes."""
+        return self.size[0] * self.size[1] * 4
+
+
+def read_frames(filename):
+    """Yields the frames of a capture as height by width arrays of 32 bit pixels."""
+    with open(filename + '.json') as file:
+        info = json.load(file)
+    shape = (info['height'], info['width'])
+    frame_bytes = shape[0] * shape[1] * 4
+    frame = np.zeros(shape, np.uint32)
+    decompressor = zlib.decompressobj()
+    with open(filename, 'rb') as file:
+        for _ in range(info['frames']):
+            if info['format'] == 'zlib':
+                length, = LENGTH.unpack(file.read(LENGTH.size))
+                changes = np.frombuffer(decompressor.decompress(file.read(length)), np.uint32)
+                frame = frame ^ changes.reshape(shape)
+            else:
+                frame = np.frombuffer(file.read(frame_bytes), np.uint32).reshape(shape)
+            yield frame
+
+def pixel_format(surface):
+    """Returns the order of the color channels in memory of a 32 bit surface,
+    named like the pixel formats of ffmpeg, such as 'bgr0'."""
+    names = dict(zip(surface.get_masks(), 'rgba'))
+    channels = [names.get(0xff << (8 * i), '0') for i in range(4)]
+    if struct.pack('=I', 1)[0] == 0:
+        channels.reverse()
+    return ''.join(channels)
@@ -0,0 +1,48 @@
+"""Renders a recorded game headless to a frame file, drawing and writing the
+frames as fast as possible rather than in real time. Raw frames can be
+turned into a video with the pixel format stored next to them:
+
+    python export.py replays/scripted-1.json scripted-1.frames --format raw
+    ffmpeg -f rawvideo -pix_fmt bgr0 -s 640x480 -r 60 -i scripted-1.frames scripted-1.mp4
+"""
+
+import argparse
+import os
+import sys
+import time
+import capture
+import regression
+import replay
+from regression import game
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a recorded game to a frame file.')
+    parser.add_argument('session', help='recorded game to render')
+    parser.add_argument('output', help='frame file to write')
+    parser.add_argument('--format', choices=capture.FORMATS, default='zlib')
+    parser.add_argument('--pool-size', type=int, default=capture.POOL_SIZE)
+    args = parser.parse_args()
+
+    session = replay.Session.load(args.session)
+    output = os.path.abspath(args.output)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    game.init_game(headless=True)
+    frames = capture.FrameCapture(output, game.SCREENRECT.size, session.fps, args.format,
+            args.pool_size)
+    start = time.perf_counter()
+    outcome, _, _ = regression.play(session, frames=frames)
+    report = frames.stop()
+    duration = time.perf_counter() - start
+
+    rate = report['frames'] / duration
+    print(f'Rendered {report["frames"]} frames to {args.output} in {duration:.1f} s '
+            f'({rate:.0f} FPS, {rate / session.fps:.1f}x real time), '
+            f'queue depth max {report["max_queue_depth"]} mean {report["mean_queue_depth"]}')
+    if outcome != session.outcome:
+        print(f'Outcome {outcome} != recorded {session.outcome}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
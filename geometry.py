@@ -59,4 +59,12 @@ class Position():
         
     def xy(self):
         """Returns the x- and y-coordinates as a tuple."""
-        return self.x, self.y
\ No newline at end of file
+        return self.x, self.y
+
+def closest_point(x, y, path):
+    """Returns the point on a path from (x0, y0) to (x1, y1) closest to a point."""
+    x0, y0, x1, y1 = path
+    dx, dy = x1 - x0, y1 - y0
+    length = dx * dx + dy * dy
+    t = 0 if length == 0 else min(max(((x - x0) * dx + (y - y0) * dy) / length, 0), 1)
+    return x0 + t * dx, y0 + t * dy
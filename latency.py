@@ -0,0 +1,113 @@
+"""Opt-in measurement of the time from input to the frame that shows its effect"""
+
+import json
+import time
+import numpy as np
+from pygame.locals import *
+import replay
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyTracker():
+    """Measures the time from the arrival of input until the frame showing
+    its effect is presented. Key presses and shots show in the next frame
+    presented, and movement and shots handled by the simulation process in
+    the first frame simulated after them.
+
+    The arrival of events is timestamped by whoever takes them from SDL,
+    which has to be done as soon as they arrive for the time they wait to
+    be handled to be measured."""
+
+    def __init__(self, filename=None):
+        """Initializes the tracker, which is disabled unless a report file is given."""
+        self.enabled = filename is not None
+        self.filename = filename
+        self.arrival = 0.0 # When the events being handled arrived
+        self.key_arrival = None # When the last movement key event since the keys were sampled arrived
+        self.bits = 0 # Movement keys held down when last sampled
+        self.unsimulated = [] # (kind, arrival, time marked) of input not simulated yet
+        self.unpresented = [] # (kind, arrival) of input not presented yet
+        self.samples = {}
+
+    def arrived(self, events, arrival):
+        """Notes the time (in perf_counter seconds) that the events about to
+        be handled arrived."""
+        if not self.enabled:
+            return
+        self.arrival = arrival
+        for event in events:
+            if event.type == KEYDOWN:
+                self.unpresented.append(('keydown', arrival))
+            if event.type in (KEYDOWN, KEYUP) and event.key in replay.KEYS:
+                self.key_arrival = arrival
+
+    def shot(self, simulated=True):
+        """Marks a shot fired by the events being handled, which is not
+        shown until the next tick if simulated is false."""
+        self.mark('shoot', simulated)
+
+    def keys(self, keystate, simulated=False):
+        """Marks a change of the movement keys held down."""
+        if not self.enabled:
+            return
+        bits = replay.encode_keys(keystate)
+        if bits != self.bits:
+            self.bits = bits
+            self.mark('move', simulated, self.key_arrival)
+        self.key_arrival = None
+
+    def mark(self, kind, simulated, arrival=None):
+        """Marks input of a kind that arrived at arrival, by default with
+        the events being handled."""
+        if not self.enabled:
+            return
+        if arrival is None:
+            arrival = self.arrival
+        if simulated:
+            self.unpresented.append((kind, arrival))
+        else:
+            self.unsimulated.append((kind, arrival, time.perf_counter()))
+
+    def simulated(self, input_time):
+        """Marks the input received before a tick that read its input at
+        input_time (in perf_counter seconds) as simulated."""
+        if not self.enabled or not self.unsimulated:
+            return
+        waiting = []
+        for kind, arrival, marked in self.unsimulated:
+            if marked <= input_time:
+                self.unpresented.append((kind, arrival))
+            else:
+                waiting.append((kind, arrival, marked))
+        self.unsimulated = waiting
+
+    def presented(self):
+        """Records the latency of the input shown by the frame just presented."""
+        if not self.enabled or not self.unpresented:
+            return
+        now = time.perf_counter()
+        for kind, arrival in self.unpresented:
+            self.samples.setdefault(kind, []).append(now - arrival)
+        self.unpresented = []
+
+    def stop(self):
+        """Writes the distribution of the latencies to the report file.
+        Returns it, or None if disabled."""
+        if not self.enabled:
+            return None
+        report = {kind: distribution(samples) for kind, samples in self.samples.items()}
+        with open(self.filename, 'w') as file:
+            json.dump(report, file, indent=1)
+        self.enabled = False
+        return report
+
+
+def distribution(samples):
+    """Returns the count, mean, percentiles and maximum of latencies in milliseconds."""
+    samples = np.array(samples) * 1000
+    result = {'count': len(samples), 'mean_ms': round(float(samples.mean()), 3)}
+    for p, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+        result[f'p{p}_ms'] = round(float(value), 3)
+    result['max_ms'] = round(float(samples.max()), 3)
+    return result
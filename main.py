@@ -4,23 +4,39 @@
 """
 
 import asyncio
+import math
 import os
 import random
+import sys
 import time
 import pygame as pg
 from pygame.locals import *
 import spaceship
 import obstacle
+import snapshot
+import scheduler
+import particles
+import telemetry
+import replay
+import worker
+import capture
+import latency
 #from click.decorators import group
 
 ICON = 'alien_a1.gif'
-SCREENRECT = pg.Rect(0, 0, 640, 480)
+SCREENRECT = pg.Rect(0, 0, 640, 480) # Logical size that the game is drawn at
 SCREEN_WIDTH, SCREEN_HEIGHT = SCREENRECT.size
-FPS = 60
+INTEGER_SCALING = True      # Scale by whole numbers for crisp pixels, otherwise scale smoothly
+LETTERBOX_COLOR = 'black'
+FPS = 60                    # Rate of simulation and rendering
+INPUT_RATE = 120            # Rate at which the keyboard is sampled
+EVENT_POLL_RATE = 1000      # Rate at which events are timestamped as they arrive while measuring latency
 AMMO_CAP = 3
 RELOAD_RATE = 1 #s
 OBSTACLE_ANIMATION_RATE = 0.5 #s
 EXHAUST_ANIMATION_RATE = 0.15 #s
+IDLE_POLL_RATE = 0.05 #s, how often input is checked while paused or game over
+WAKE_EVENTS = (QUIT, KEYDOWN, VIDEOEXPOSE, WINDOWEXPOSED, WINDOWSIZECHANGED) # Events handled while idle
 OBSTACLE_CHOICE_WEIGHTS = { # Weighted likelihood of obstacles being chosen
     obstacle.AlienA: 3,
     obstacle.AlienB: 2,
@@ -35,17 +51,48 @@ GAME_OVER_TEXT = 'GAME OVER'
 GAME_OVER_IMAGE = 'spaceship.gif'
 PLAY_AGAIN_PROMPT_TEXT = 'Press ENTER to play again.'
 SCORE_TEXT = 'Your final score: {}'
+PAUSED_TEXT = 'PAUSED'
+RESUME_PROMPT_TEXT = 'Press P to resume.'
 FIRST_SPAWN_TIME = 0.5      # Time after which first obstacle will spawn
 INITIAL_SPAWN_RATE = 5      # Initial spawn rate
 MID_SPAWN_RATE_TIME = 25    # Time after which spawn rate halfway between initial and limit
 SPAWN_RATE_LIMIT = 1        # Spawn rate will approach but not reach this value
+SNAPSHOT_INTERVAL = 0.5     # Time between snapshots kept for rewinding
+SNAPSHOT_CAPACITY = 120     # Number of snapshots kept for rewinding
+PARTICLE_CAP = 1500         # Most particles shown at once
+EXPLOSION_PARTICLES = 40    # Particles emitted when an obstacle is destroyed
+EXPLOSION_SPEED = 3.5       # px per tick
+EXPLOSION_LIFE = 40         # ticks
+THRUST_PARTICLES = 2        # Particles emitted per tick while flying forward
+THRUST_SPEED = 2.5          # px per tick
+THRUST_LIFE = 20            # ticks
+THRUST_SPREAD = 0.5         # radians
+ALIEN_EXPLOSION_COLOR = '#8ef06a'
+ASTEROID_EXPLOSION_COLOR = '#b9b2a8'
+THRUST_COLOR = '#ffb347'
+PARTICLE_COLORS = (ALIEN_EXPLOSION_COLOR, ASTEROID_EXPLOSION_COLOR, THRUST_COLOR) # By index, to send between processes
+COLLIDE_PLAYER = obstacle.detailed(pg.sprite.collide_mask)
+COLLIDE_LASER = obstacle.detailed(spaceship.collide_laser)
+MEMORY_LOG = os.environ.get('MEMORY_LOG') # File to log memory use per frame to, if set
+REPLAY_DIR = os.environ.get('REPLAY_DIR') # Directory to record games to, if set
+CAPTURE_FILE = os.environ.get('CAPTURE_FILE') # File to capture the frames played to, if set
+CAPTURE_FORMAT = os.environ.get('CAPTURE_FORMAT', 'zlib') # raw, zlib or mmap
+LATENCY_LOG = os.environ.get('LATENCY_LOG') # File to report input latency to, if set
+LOW_LATENCY = bool(os.environ.get('LOW_LATENCY')) # Sample input right before each frame, if set
+SIMULATION_PROCESS = bool(os.environ.get('SIMULATION_PROCESS')) # Simulate in a separate process, if set
 
 
-def new_game():
-    """Starts a new game."""
-    global obstacles, aliens, asteroids, lasers, sprites, playergroup, player, \
-        ammo, spawn_time_left, reload_time_left, reloading, score, \
-        spawn_rate, start_time
+def new_game(seed=None):
+    """Starts a new game. Games with the same seed and input play out the same."""
+    global player, ammo, spawn_time_left, reload_time_left, reloading, score, \
+        spawn_rate, game_time, alien_image_index, exhaust_image_index, \
+        alien_animation_time_left, exhaust_animation_time_left
+    
+    # Seed the random choices of the game
+    if seed is None:
+        seed = random.randrange(2**32)
+    random.seed(seed)
+    recorder.start(seed, FPS)
     
     # Initialize score
     score = 0
@@ -54,10 +101,31 @@ def new_game():
     spawn_time_left = 0
     reload_time_left = 0
     reloading = False
-    start_time = time.time()
+    game_time = 0
     spawn_rate = FIRST_SPAWN_TIME
+    alien_image_index = 0
+    exhaust_image_index = 0
+    alien_animation_time_left = OBSTACLE_ANIMATION_RATE
+    exhaust_animation_time_left = EXHAUST_ANIMATION_RATE
     
     # Initialize game groups
+    new_groups()
+    
+    # Create player
+    player = spaceship.Spaceship((SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2), -90.0, sprites, playergroup)
+    ammo = AMMO_CAP
+    
+    # Forget the snapshots and particles of the previous game
+    snapshots.clear()
+    particle_system.clear()
+    particle_system.reseed(seed)
+    
+    # Show background
+    screen.blit(background, (0, 0))
+    
+def new_groups():
+    """Replaces the game groups with empty ones."""
+    global obstacles, aliens, asteroids, lasers, sprites, playergroup
     obstacles = pg.sprite.Group()
     aliens = pg.sprite.Group()
     asteroids = pg.sprite.Group()
@@ -65,24 +133,113 @@ def new_game():
     sprites = pg.sprite.RenderUpdates()
     playergroup = pg.sprite.GroupSingle()
     
-    # Create player
-    player = spaceship.Spaceship((SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2), -90.0, sprites, playergroup)
-    ammo = AMMO_CAP
+def capture_world():
+    """Returns a snapshot of the sprites and timers."""
+    timers = snapshot.Timers(spawn_time_left, reload_time_left, spawn_rate,
+            elapsed_time(), alien_animation_time_left, exhaust_animation_time_left,
+            reloading, ammo, alien_image_index, exhaust_image_index, score)
+    return snapshot.capture(timers, player, sprites)
     
-    # Show background
+def restore_world(world):
+    """Restores the sprites and timers from a snapshot."""
+    global player, ammo, spawn_time_left, reload_time_left, reloading, score, \
+        spawn_rate, game_time, alien_image_index, exhaust_image_index, \
+        alien_animation_time_left, exhaust_animation_time_left
+    # The input after restoring no longer matches the recorded game
+    recorder.cancel()
+    new_groups()
+    timers, player = snapshot.restore(world, sprites, playergroup, obstacles, aliens, asteroids, lasers)
+    spawn_time_left = timers.spawn_time_left
+    reload_time_left = timers.reload_time_left
+    spawn_rate = timers.spawn_rate
+    game_time = timers.elapsed_time
+    alien_animation_time_left = timers.alien_animation_time_left
+    exhaust_animation_time_left = timers.exhaust_animation_time_left
+    alien_image_index = timers.alien_image_index
+    exhaust_image_index = timers.exhaust_image_index
+    reloading = timers.reloading
+    ammo = timers.ammo
+    score = timers.score
+    particle_system.clear()
     screen.blit(background, (0, 0))
     
 
 async def main():
-    global screen, background, ammo, spawn_time_left, reload_time_left, reloading, score
+    global running, simulation
+    init_game()
+    
+    # Leave this process to input, rendering and sound if asked to
+    if SIMULATION_PROCESS:
+        simulation = worker.SimulationProcess()
+        simulation.start()
+    
+    try:
+        # Run the tasks of the main loop until the game is quit
+        running = True
+        update_activity()
+        tasks = [handle_input(), play_sounds(), render()]
+        if simulation is not None:
+            tasks.append(follow_simulation())
+        elif not LOW_LATENCY:
+            tasks.append(simulate())
+        if input_latency.enabled:
+            tasks.append(poll_events())
+        await asyncio.gather(*tasks)
+        memory.stop()
+        report = input_latency.stop()
+        if report is not None:
+            for kind, result in report.items():
+                print(f'{kind} latency: {result["count"]} samples, mean {result["mean_ms"]} ms, '
+                        f'p50 {result["p50_ms"]} ms, p95 {result["p95_ms"]} ms, p99 {result["p99_ms"]} ms, '
+                        f'max {result["max_ms"]} ms')
+        report = frames.stop()
+        if report is not None:
+            print(f'Captured {report["frames"]} frames to {CAPTURE_FILE}, dropped {report["dropped"]}, '
+                    f'queue depth max {report["max_queue_depth"]} mean {report["mean_queue_depth"]}')
+        if simulation is not None and simulation.dropped_events:
+            print(f'Dropped {simulation.dropped_events} sounds and particle emissions '
+                    'that the simulation process sent faster than they were taken')
+    finally:
+        if simulation is not None:
+            simulation.stop()
+        
+    # Quit pygame
+    pg.mixer.quit()
+    pg.quit()
+    
+def init_game(headless=False):
+    """Sets up pygame, loads the resources and starts the first game.
+    A headless game does not play music."""
+    global window, screen, background, snapshots, quicksave, paused, keystate, \
+        sound_queue, playing, redraw, arrivals, recorder, laser_sound, alien_kill_sound, asteroid_kill_sound, spaceship_kill_sound, \
+        subtitle_font, score_font, gameover_message, gameover_rect, spaceship_image, \
+        spaceship_rect, playagain_message, playagain_rect, paused_message, paused_rect, \
+        resume_message, resume_rect, obstacle_choices, particle_system, memory, sounds, simulation, frames, input_latency
+    # Start measuring memory use if asked to
+    memory = telemetry.MemoryTelemetry(MEMORY_LOG)
+    
     # Initialize pygame
     pg.init()
     pg.mixer.init()
     
-    # Set up the game window
-    screen = pg.display.set_mode(SCREENRECT.size)
+    # Set up the game window and the screen buffer that is scaled to fit it
+    window = pg.display.set_mode(SCREENRECT.size, RESIZABLE)
     pg.display.set_caption('Aliens and Asteroids')
     pg.display.set_icon(load_image(ICON))
+    screen = pg.surface.Surface(SCREENRECT.size).convert()
+    update_viewport()
+    
+    # Start capturing the frames played if asked to
+    frames = capture.FrameCapture(None if headless else CAPTURE_FILE, SCREENRECT.size, FPS,
+            CAPTURE_FORMAT, lock=memory.background())
+    
+    # Start measuring input latency if asked to
+    input_latency = latency.LatencyTracker(None if headless else LATENCY_LOG)
+    
+    # Let the sprite classes move around on the screen buffer
+    spaceship.Spaceship.area = screen
+    spaceship.Laser.area = screen
+    obstacle.Obstacle.area = screen
     
     # Load images and assign them to sprite classes
     spaceship.Spaceship.images = [load_image('spaceship.gif')]
@@ -100,8 +257,10 @@ async def main():
     alien_kill_sound = load_sound('alien_kill.ogg')
     asteroid_kill_sound = load_sound('asteroid_kill.ogg')
     spaceship_kill_sound = load_sound('spaceship_kill.ogg')
-    load_music('maxstack - through space.ogg')
-    pg.mixer.music.play(-1)
+    sounds = [laser_sound, alien_kill_sound, asteroid_kill_sound, spaceship_kill_sound] # By index, to send between processes
+    if not headless:
+        load_music('maxstack - through space.ogg')
+        pg.mixer.music.play(-1)
     
     # Create the background and tile the background image
     bgtile = load_image('background.gif')
@@ -122,6 +281,10 @@ async def main():
     spaceship_rect = spaceship_image.get_rect(center=(SCREEN_WIDTH / 2, SCREEN_HEIGHT * 9 / 16))
     playagain_message = subtitle_font.render(PLAY_AGAIN_PROMPT_TEXT, True, TEXT_COLOR)
     playagain_rect = playagain_message.get_rect(center=(SCREEN_WIDTH / 2, SCREEN_HEIGHT * 4 / 5))
+    paused_message = title_font.render(PAUSED_TEXT, True, TEXT_COLOR)
+    paused_rect = paused_message.get_rect(center=(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2))
+    resume_message = subtitle_font.render(RESUME_PROMPT_TEXT, True, TEXT_COLOR)
+    resume_rect = resume_message.get_rect(center=(SCREEN_WIDTH / 2, SCREEN_HEIGHT * 4 / 5))
     
     # Create a list of obstacle choices with weighted probabilities of being chosen
     obstacle_choices = []
@@ -130,146 +293,496 @@ async def main():
             obstacle_choices.append(obs)
     
     # Start first game
+    snapshots = snapshot.SnapshotBuffer(SNAPSHOT_CAPACITY, SNAPSHOT_INTERVAL)
+    particle_system = particles.ParticleSystem(PARTICLE_CAP)
+    quicksave = None
+    paused = False
+    recorder = replay.Recorder()
+    keystate = pg.key.get_pressed()
+    sound_queue = asyncio.Queue()
+    playing = asyncio.Event()
+    redraw = asyncio.Event()
+    arrivals = [] # Events taken by poll_events() and when they arrived
+    simulation = None # Simulation process, if the game is not simulated here
     new_game()
     
-    # Run the main loop
-    clock = pg.time.Clock()
-    alien_animation_timer = pg.USEREVENT + 1
-    exhaust_animation_timer = pg.USEREVENT + 2
-    alien_image_index = 0
-    exhaust_image_index = 0
-    num_exhaust_images = len(spaceship.Exhaust.images)
-    pg.time.set_timer(alien_animation_timer, int(OBSTACLE_ANIMATION_RATE * 1000))
-    pg.time.set_timer(exhaust_animation_timer, int(EXHAUST_ANIMATION_RATE * 1000))
-    running = True
+async def handle_input():
+    """Samples the keyboard and handles events until the game is quit."""
+    ticker = scheduler.Ticker(INPUT_RATE)
     while running:
-        # If the player is still alive, run the game
-        if player.alive():
-            for event in pg.event.get():
-                if event.type == QUIT:
-                    running = False
-                
-                # Handle shooting
-                if event.type == KEYDOWN and event.key == K_SPACE and ammo > 0:
-                    player.shoot(sprites, lasers)
-                    laser_sound.play()
-                    ammo -= 1
-                    if not reloading:
-                        reloading = True
-                        reload_time_left = RELOAD_RATE
-                
-                # Handle animation
-                if event.type == alien_animation_timer:
-                    if alien_image_index == 0: alien_image_index = 1
-                    else: alien_image_index = 0
-                    for alien in aliens.spritedict:
-                        alien.image_index = alien_image_index
-                if event.type == exhaust_animation_timer:
-                    exhaust_image_index += 1
-                    if exhaust_image_index >= num_exhaust_images: exhaust_image_index = 0
-                    player.exhaust.image_index = exhaust_image_index
-                    
-            # Handle player movement
-            keystate = pg.key.get_pressed()
-            move_direction = keystate[K_UP] - keystate[K_DOWN]
-            if move_direction > 0:
-                player.forward()
-            elif move_direction < 0:
-                player.backward()
-            direction = keystate[K_RIGHT] - keystate[K_LEFT]
-            if direction != 0:
-                player.rotate(direction)
-                
-            # If spawn timer is up, spawn next enemy/obstacle
-            if spawn_time_left <= 0:
-                clazz = random.choice(obstacle_choices)
-                if issubclass(clazz, obstacle.AlienC):
-                    clazz(player, sprites, obstacles, aliens)
-                elif issubclass(clazz, obstacle.Alien):
-                    clazz(sprites, obstacles, aliens)
-                else:
-                    clazz(sprites, obstacles, asteroids)
-                    
-                update_spawn_rate()
-                spawn_time_left = spawn_rate
-            
-            # If reload timer is up, reload
-            if reloading and reload_time_left <= 0:
-                ammo += 1
-                if ammo == AMMO_CAP:
-                    reloading = False
-                
-            # Display background
-            screen.blit(background, (0, 0))
-            
-            # Update sprites
-            sprites.clear(screen, background)
-            sprites.update()
-            sprites.draw(screen)
-    
-            # Display score
-            score_message = score_font.render(str(score), True, TEXT_COLOR)
-            score_rect = score_message.get_rect(center=(SCREEN_WIDTH / 2, score_message.get_height()))
-            screen.blit(score_message, score_rect)
-            
-            # Detect collisions between aliens/asteroids and player
-            # If collision is detected, kill player
-            if pg.sprite.groupcollide(obstacles, playergroup, False, False) \
-            and pg.sprite.groupcollide(obstacles, playergroup, False, True, pg.sprite.collide_mask):
-                    spaceship_kill_sound.play()
-            
-            # Detect collisions between aliens/asteroids and laser
-            # If collision is detected, kill obstacle and remove laser
-            if pg.sprite.groupcollide(obstacles, lasers, False, False) \
-            and pg.sprite.groupcollide(obstacles, lasers, False, False, pg.sprite.collide_mask):
-                for alien in pg.sprite.groupcollide(aliens, lasers, True, True):
-                    alien_kill_sound.play()
-                    score += alien.points
-                for asteroid, laser_list in pg.sprite.groupcollide(asteroids, lasers, False, False, pg.sprite.collide_mask).items():
-                    laser = laser_list[0]
-                    if issubclass(asteroid.__class__, obstacle.AsteroidM) or issubclass(asteroid.__class__, obstacle.AsteroidL):
-                        asteroid.kill(laser.angle)
-                    else:
-                        asteroid.kill()
-                    laser.kill()
-                    asteroid_kill_sound.play()
-                    score += asteroid.points
-            
-            # Count down the spawn timer
-            spawn_time_left -= 1 / FPS
-            # Count down the reload timer
-            if reloading:
-                reload_time_left -= 1 / FPS
-            
-        # If the player is not alive, display the game over screen
+        # With low latency pacing the renderer samples input right before each frame
+        if playing.is_set() and LOW_LATENCY:
+            ticker.reset()
+            await asyncio.sleep(IDLE_POLL_RATE)
+            continue
+        
+        # While the game is not being played, wait for events instead of polling
+        if playing.is_set():
+            batches = take_events()
         else:
-            score_message = subtitle_font.render(SCORE_TEXT.format(score), True, TEXT_COLOR)
-            score_rect = score_message.get_rect(center=(SCREEN_WIDTH / 2, SCREEN_HEIGHT * 5 / 16))
+            events = await wait_for_events()
+            batches = [(time.perf_counter(), events)]
+        
+        sample_input(batches)
+        if playing.is_set():
+            await ticker.wait()
+        else:
+            ticker.reset()
+    
+    # Wake up the other tasks so that they can finish
+    playing.set()
+    redraw.set()
+    sound_queue.put_nowait(None)
+    
+async def poll_events():
+    """Takes events from SDL as soon as they arrive while the game is being
+    played and notes when they arrived, so that the time they wait to be
+    handled counts toward the input latency measured."""
+    ticker = scheduler.Ticker(EVENT_POLL_RATE)
+    while running:
+        if playing.is_set():
+            events = pg.event.get()
+            if events:
+                arrivals.append((time.perf_counter(), events))
+            await ticker.wait()
+        else:
+            ticker.reset()
+            await playing.wait()
+    
+def take_events():
+    """Returns the events that arrived since they were last taken, in
+    batches along with the time they arrived."""
+    batches = arrivals[:]
+    arrivals.clear()
+    events = pg.event.get()
+    if events:
+        batches.append((time.perf_counter(), events))
+    return batches
+    
+def sample_input(batches):
+    """Handles batches of events along with the time they arrived and
+    samples the keys held down for player movement."""
+    global keystate
+    with memory.section('input'):
+        for arrival, events in batches:
+            input_latency.arrived(events, arrival)
+            handle_events(events)
+    
+    keystate = pg.key.get_pressed()
+    input_latency.keys(keystate)
+    if simulation is not None:
+        simulation.send_keys(keystate)
+    update_activity()
+    
+def handle_events(events):
+    """Handles the events that arrived since the keyboard was last sampled."""
+    global running, paused, quicksave
+    for event in events:
+        if event.type == QUIT:
+            running = False
+        
+        # Redraw on input or when the window needs to be repainted
+        if event.type in (KEYDOWN, VIDEOEXPOSE, WINDOWEXPOSED):
+            redraw.set()
+        
+        # Handle resizing the window
+        if event.type == KEYDOWN and event.key == K_F11:
+            toggle_fullscreen()
+        if event.type == WINDOWSIZECHANGED:
+            update_viewport()
+            redraw.set()
+        
+        # Leave game input to the simulation process if there is one
+        if simulation is not None:
+            forward_event(event)
+            continue
+        
+        # If the player is still alive and the game is not paused, handle game input
+        if player.alive() and not paused:
+            # Handle shooting
+            if event.type == KEYDOWN and event.key == K_SPACE and ammo > 0:
+                shoot()
             
-            screen.fill(GAME_OVER_SCREEN_COLOR)
-            screen.blit(gameover_message, gameover_rect)
-            screen.blit(playagain_message, playagain_rect)
-            screen.blit(spaceship_image, spaceship_rect)
-            screen.blit(score_message, score_rect)
+            # Handle pausing
+            if event.type == KEYDOWN and event.key in (K_p, K_ESCAPE):
+                paused = True
             
-            for event in pg.event.get():
-                if event.type == QUIT:
-                    running = False
-                
-                # Handle starting new game
-                if event.type == KEYDOWN and event.key == K_RETURN:
-                    new_game()
+            # Handle saving
+            if event.type == KEYDOWN and event.key == K_F5:
+                quicksave = capture_world()
         
-        # Update display and advance frame
-        pg.display.update()
-        clock.tick(FPS)
+        # Handle resuming
+        elif paused:
+            if event.type == KEYDOWN and event.key in (K_p, K_ESCAPE):
+                paused = False
         
-        # Give control back to the main thread
-        await asyncio.sleep(0)
+        # Handle starting new game
+        elif event.type == KEYDOWN and event.key == K_RETURN:
+            new_game()
         
-    # Quit pygame
-    pg.mixer.quit()
-    pg.quit()
+        # Handle loading and rewinding
+        if event.type == KEYDOWN and event.key == K_F9 and quicksave is not None:
+            restore_world(quicksave)
+        if event.type == KEYDOWN and event.key == K_BACKSPACE and len(snapshots) > 0:
+            restore_world(snapshots.pop())
+    
+def forward_event(event):
+    """Sends game input to the simulation process, which handles it like handle_events()."""
+    global paused
+    if event.type != KEYDOWN:
+        return
+    if simulation.alive and not paused:
+        if event.key == K_SPACE:
+            simulation.send(worker.SHOOT)
+            input_latency.shot(simulated=False)
+        if event.key in (K_p, K_ESCAPE):
+            paused = True
+            simulation.send(worker.PAUSE)
+        if event.key == K_F5:
+            simulation.send(worker.SAVE)
+    elif paused:
+        if event.key in (K_p, K_ESCAPE):
+            paused = False
+            simulation.send(worker.RESUME)
+    elif event.key == K_RETURN:
+        simulation.send(worker.NEW_GAME)
+    if event.key == K_F9:
+        simulation.send(worker.LOAD)
+    if event.key == K_BACKSPACE:
+        simulation.send(worker.REWIND)
+    
+def shoot():
+    """Shoots a laser from the spaceship and starts reloading."""
+    global ammo, reloading, reload_time_left
+    player.shoot(sprites, lasers)
+    recorder.shot()
+    input_latency.shot()
+    sound_queue.put_nowait(laser_sound)
+    ammo -= 1
+    if not reloading:
+        reloading = True
+        reload_time_left = RELOAD_RATE
+    
+async def simulate():
+    """Advances the game at a fixed rate while it is being played."""
+    ticker = scheduler.Ticker(FPS)
+    while running:
+        if playing.is_set():
+            for _ in range(await ticker.wait()):
+                if running and playing.is_set():
+                    simulate_tick()
+        else:
+            ticker.reset()
+            await playing.wait()
+    
+async def follow_simulation():
+    """Takes the frames, sounds and particles published by the simulation
+    process at a fixed rate, in place of simulating the game here."""
+    global score, paused
+    ticker = scheduler.Ticker(FPS)
+    while running:
+        for kind, index, count, x, y, speed, life, direction, spread in simulation.update().tolist():
+            if kind == worker.SOUND:
+                sound_queue.put_nowait(sounds[index])
+            else:
+                particle_system.emit(x, y, count, speed, life, PARTICLE_COLORS[index], direction, spread)
+        score = simulation.state['score']
+        input_latency.simulated(simulation.state['input_time'] / 1e9)
+        # The player may have died before a pause sent from an older frame
+        # arrived, which the simulation ignores, so show the game over screen
+        if paused and not simulation.alive:
+            paused = False
+            pg.mixer.unpause()
+            pg.mixer.music.unpause()
+            redraw.set()
+        update_activity()
+        if playing.is_set():
+            particle_system.update()
+            # The sprites are in the simulation process, which logs their memory use
+            memory.end_frame(())
+            await ticker.wait()
+        else:
+            ticker.reset()
+            await asyncio.sleep(IDLE_POLL_RATE)
+    
+def simulate_tick():
+    """Advances the game by one tick."""
+    global ammo, spawn_time_left, reload_time_left, reloading, game_time, \
+        alien_image_index, exhaust_image_index, alien_animation_time_left, \
+        exhaust_animation_time_left
+    input_latency.simulated(time.perf_counter())
+    recorder.tick(keystate)
+    
+    # Handle player movement
+    move_direction = keystate[K_UP] - keystate[K_DOWN]
+    if move_direction > 0:
+        player.forward()
+        # Emit exhaust particles from behind the spaceship
+        angle = math.radians(player.velocity.direction) + math.pi
+        particle_system.emit(player.exhaust.pos.x, player.exhaust.pos.y, THRUST_PARTICLES,
+                THRUST_SPEED, THRUST_LIFE, THRUST_COLOR, angle, THRUST_SPREAD)
+    elif move_direction < 0:
+        player.backward()
+    direction = keystate[K_RIGHT] - keystate[K_LEFT]
+    if direction != 0:
+        player.rotate(direction)
+        
+    # If spawn timer is up, spawn next enemy/obstacle
+    if spawn_time_left <= 0:
+        clazz = random.choice(obstacle_choices)
+        with memory.section('spawning'):
+            if issubclass(clazz, obstacle.AlienC):
+                clazz(player, sprites, obstacles, aliens)
+            elif issubclass(clazz, obstacle.Alien):
+                clazz(sprites, obstacles, aliens)
+            else:
+                clazz(sprites, obstacles, asteroids)
+            
+        update_spawn_rate()
+        spawn_time_left = spawn_rate
+    
+    # If reload timer is up, reload
+    if reloading and reload_time_left <= 0:
+        ammo += 1
+        if ammo == AMMO_CAP:
+            reloading = False
+    
+    # Handle animation
+    if alien_animation_time_left <= 0:
+        if alien_image_index == 0: alien_image_index = 1
+        else: alien_image_index = 0
+        for alien in aliens.spritedict:
+            alien.image_index = alien_image_index
+        alien_animation_time_left = OBSTACLE_ANIMATION_RATE
+    if exhaust_animation_time_left <= 0:
+        exhaust_image_index += 1
+        if exhaust_image_index >= len(spaceship.Exhaust.images): exhaust_image_index = 0
+        player.exhaust.image_index = exhaust_image_index
+        exhaust_animation_time_left = EXHAUST_ANIMATION_RATE
+    
+    # Update sprites and particles, with less detail for obstacles away from the action
+    with memory.section('sprites'):
+        obstacle.update_detail(obstacles, [player] + lasers.sprites())
+        sprites.update()
+    with memory.section('particles'):
+        particle_system.update()
+    
+    with memory.section('collisions'):
+        handle_collisions()
+    
+    # Stop recording the game when the player dies
+    if not player.alive():
+        save_recording()
+    
+    # Count down the spawn timer
+    spawn_time_left -= 1 / FPS
+    # Count down the animation timers
+    alien_animation_time_left -= 1 / FPS
+    exhaust_animation_time_left -= 1 / FPS
+    # Advance the game time
+    game_time += 1 / FPS
+    # Count down the reload timer
+    if reloading:
+        reload_time_left -= 1 / FPS
+    # Take a snapshot for rewinding if one is due
+    if player.alive() and snapshots.advance(1 / FPS):
+        with memory.section('snapshots'):
+            snapshots.push(capture_world())
+    
+    update_activity()
+    memory.end_frame(sprites)
+    
+def handle_collisions():
+    """Kills the player, obstacles and lasers that collided."""
+    global score
+    
+    # Detect collisions between aliens/asteroids and player
+    # If collision is detected, kill player
+    if pg.sprite.groupcollide(obstacles, playergroup, False, False) \
+    and pg.sprite.groupcollide(obstacles, playergroup, False, True, COLLIDE_PLAYER):
+            sound_queue.put_nowait(spaceship_kill_sound)
+    
+    # Detect collisions between aliens/asteroids and the paths of the lasers,
+    # first by the rectangles the lasers swept through, then by bounding
+    # circles and last by their masks
+    obstacle_list = obstacles.sprites()
+    rects = [obs.rect for obs in obstacle_list]
+    hit = {}
+    for laser in lasers:
+        for i in laser.sweep.collidelistall(rects):
+            if COLLIDE_LASER(obstacle_list[i], laser):
+                hit.setdefault(i, []).append(laser)
+    # Handle the hits in the order of the obstacles, so that games replay the same
+    hits = {obstacle_list[i]: hit[i] for i in sorted(hit)}
+    
+    # If collision is detected, kill obstacle and remove laser
+    for obs, laser_list in hits.items():
+        if isinstance(obs, obstacle.Alien):
+            obs.kill()
+            for laser in laser_list:
+                laser.kill()
+            sound_queue.put_nowait(alien_kill_sound)
+            particle_system.emit(obs.pos.x, obs.pos.y, EXPLOSION_PARTICLES,
+                    EXPLOSION_SPEED, EXPLOSION_LIFE, ALIEN_EXPLOSION_COLOR)
+            score += obs.points
+        else:
+            laser = laser_list[0]
+            if issubclass(obs.__class__, obstacle.AsteroidM) or issubclass(obs.__class__, obstacle.AsteroidL):
+                obs.kill(laser.angle)
+            else:
+                obs.kill()
+            laser.kill()
+            sound_queue.put_nowait(asteroid_kill_sound)
+            particle_system.emit(obs.pos.x, obs.pos.y, EXPLOSION_PARTICLES,
+                    EXPLOSION_SPEED, EXPLOSION_LIFE, ASTEROID_EXPLOSION_COLOR)
+            score += obs.points
+    
+async def play_sounds():
+    """Plays the sounds queued by the other tasks until the game is quit."""
+    while True:
+        sound = await sound_queue.get()
+        if sound is None:
+            break
+        sound.play()
+    
+async def render():
+    """Draws the game at a fixed rate while it is being played, and the
+    paused or game over screen only when it needs to be redrawn.
+    With low latency pacing, also samples input and simulates the game
+    right before drawing each frame."""
+    ticker = scheduler.Ticker(FPS)
+    while running:
+        if playing.is_set() and LOW_LATENCY:
+            # Sleep before sampling input rather than after presenting,
+            # so that each frame shows the input that arrived just before it
+            ticks = await ticker.wait()
+            sample_input(take_events())
+            if simulation is None:
+                for _ in range(ticks):
+                    if running and playing.is_set():
+                        simulate_tick()
+            with memory.section('render'):
+                draw_game()
+                present()
+            frames.capture(screen)
+        elif playing.is_set():
+            with memory.section('render'):
+                draw_game()
+                present()
+            frames.capture(screen)
+            await ticker.wait()
+        else:
+            ticker.reset()
+            redraw.clear()
+            # Display the paused game
+            if paused:
+                draw_game()
+                screen.blit(paused_message, paused_rect)
+                screen.blit(resume_message, resume_rect)
+            # Display the game over screen
+            else:
+                draw_game_over()
+            present()
+            await redraw.wait()
+    
+def present():
+    """Scales the screen buffer to the window and shows it."""
+    size = viewport.get_size()
+    if size == SCREENRECT.size:
+        viewport.blit(screen, (0, 0))
+    elif INTEGER_SCALING:
+        pg.transform.scale(screen, size, viewport)
+    else:
+        pg.transform.smoothscale(screen, size, viewport)
+    pg.display.update()
+    input_latency.presented()
+    
+def update_viewport():
+    """Fits the area of the window that the screen buffer is scaled to
+    inside the window, keeping the aspect ratio."""
+    global window, viewport
+    window = pg.display.get_surface()
+    window_rect = window.get_rect()
+    scale = min(window_rect.width / SCREEN_WIDTH, window_rect.height / SCREEN_HEIGHT)
+    # Whole number scaling only works if the window is at least the logical size
+    if INTEGER_SCALING and scale >= 1:
+        scale = int(scale)
+    viewport_rect = pg.Rect(0, 0, int(SCREEN_WIDTH * scale), int(SCREEN_HEIGHT * scale))
+    viewport_rect.center = window_rect.center
+    window.fill(LETTERBOX_COLOR)
+    viewport = window.subsurface(viewport_rect)
+    
+def toggle_fullscreen():
+    """Switches between fullscreen and a resizable window."""
+    if pg.display.get_surface().get_flags() & FULLSCREEN:
+        pg.display.set_mode(SCREENRECT.size, RESIZABLE)
+    else:
+        pg.display.set_mode((0, 0), FULLSCREEN)
+    update_viewport()
+    
+def draw_game():
+    """Draws the sprites and score."""
+    # Display background
+    screen.blit(background, (0, 0))
+    
+    # Display sprites and particles, except obstacles off screen
+    if simulation is None:
+        screen.blits([(sprite.image, sprite.rect) for sprite in sprites
+                if getattr(sprite, 'detail', None) != obstacle.DETAIL_LOW], False)
+    else:
+        simulation.draw(screen)
+    particle_system.draw(screen)
+
+    # Display score
+    score_message = score_font.render(str(score), True, TEXT_COLOR)
+    score_rect = score_message.get_rect(center=(SCREEN_WIDTH / 2, score_message.get_height()))
+    screen.blit(score_message, score_rect)
+    
+def draw_game_over():
+    """Draws the game over screen."""
+    score_message = subtitle_font.render(SCORE_TEXT.format(score), True, TEXT_COLOR)
+    score_rect = score_message.get_rect(center=(SCREEN_WIDTH / 2, SCREEN_HEIGHT * 5 / 16))
+    
+    screen.fill(GAME_OVER_SCREEN_COLOR)
+    screen.blit(gameover_message, gameover_rect)
+    screen.blit(playagain_message, playagain_rect)
+    screen.blit(spaceship_image, spaceship_rect)
+    screen.blit(score_message, score_rect)
+    
+def update_activity():
+    """Starts or stops the simulation, animation timers and music
+    when the game starts or stops being played."""
+    alive = player.alive() if simulation is None else simulation.alive
+    active = alive and not paused
+    if active == playing.is_set():
+        return
+    if active:
+        playing.set()
+        pg.mixer.unpause()
+        pg.mixer.music.unpause()
+    else:
+        playing.clear()
+        if paused:
+            pg.mixer.pause()
+            pg.mixer.music.pause()
+    # Wake up the renderer, which may be waiting for a redraw
+    redraw.set()
+    
+async def wait_for_events():
+    """Waits without busy-polling until there is at least one event,
+    then returns the pending events."""
+    # The browser cannot be blocked, so check in at a low rate and hand control
+    # back to it in between. Peeking without event types is unsafe in pygame 2.6.
+    if sys.platform == 'emscripten':
+        while running and not pg.event.peek(WAKE_EVENTS):
+            await asyncio.sleep(IDLE_POLL_RATE)
+        return pg.event.get()
+    # Block until an event arrives, letting the other tasks run now and then
+    event = pg.event.wait(int(IDLE_POLL_RATE * 1000))
+    while event.type == NOEVENT:
+        await asyncio.sleep(0)
+        event = pg.event.wait(int(IDLE_POLL_RATE * 1000))
+    return [event] + pg.event.get()
     
 def update_spawn_rate():
     """Updates the spawn rate according to a decreasing function."""
@@ -281,8 +794,26 @@ def update_spawn_rate():
     spawn_rate = (h / ((t / 4) + (h / (k - L)))) + L
     
 def elapsed_time():
-    """Returns the execution time in seconds."""
-    return time.time() - start_time
+    """Returns the game time in seconds, which only advances while the game is played."""
+    return game_time
+
+def outcome():
+    """Returns the score and number of sprites of each kind, to compare replays by."""
+    return {
+        'score': score,
+        'alive': player.alive(),
+        'obstacles': len(obstacles),
+        'aliens': len(aliens),
+        'asteroids': len(asteroids),
+        'lasers': len(lasers),
+        }
+
+def save_recording():
+    """Saves the recording of the game, if one is being made."""
+    session = recorder.finish(outcome())
+    if session is not None and REPLAY_DIR is not None:
+        os.makedirs(REPLAY_DIR, exist_ok=True)
+        session.save(os.path.join(REPLAY_DIR, time.strftime('%Y%m%d-%H%M%S.json')))
 
 def load_image(filename):
     """Loads an image."""
@@ -308,4 +839,5 @@ def load_font(filename, size):
     file = os.path.join('data', filename)
     return pg.font.Font(file, size)
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == '__main__':
+    asyncio.run(main())
\ No newline at end of file
@@ -25,14 +25,22 @@ ASTEROID_MAX_ROTATE_ANGLE = 4.3
 NUM_PIECES = 2, 3 # Number of broken asteroid pieces M and L split into
 ASTEROID_POINTS = 1
 
+# Level of detail constants
+DETAIL_LOW = 0 # Off screen: only move
+DETAIL_VISIBLE = 1 # On screen: also rotate the image to draw
+DETAIL_FULL = 2 # Near the player or a laser: also build the mask to collide with
+DETAIL_DISTANCE = 120 # px, distance from the player or a laser within which obstacles are in full detail
+DETAIL_MARGIN = 16 # px, distance off screen within which obstacles are treated as on screen
+
 class Obstacle(pg.sprite.Sprite):
     """Abstract class for any obstacle"""
     
     images = []
+    area = None # Surface the obstacle moves around on
+    detail = DETAIL_FULL # Level of detail the obstacle is updated with
     
     def __init__(self, *groups):
         super().__init__(groups)
-        self.area = pg.display.get_surface()
         
         # Initial position is random position just off screen
         screen_width = self.area.get_width()
@@ -75,6 +83,8 @@ class Obstacle(pg.sprite.Sprite):
 class Alien(Obstacle):
     """Abstract class for an enemy that moves around the screen"""
 
+    rotation = 0 # Angle the image is rotated by
+    
     def __init__(self, *groups):
         super().__init__(groups)
         self.image_index = 0
@@ -83,6 +93,7 @@ class Alien(Obstacle):
         """Updates the position of the alien on the screen."""
         # Change the image for the animation
         self.image = self.images[self.image_index]
+        self.rotation = 0
         # Move according to subclass pattern
         self.move()
         # Move the alien to the opposite side if out of bounds
@@ -93,6 +104,16 @@ class Alien(Obstacle):
     def move(self):
         pass
     
+    def rotate_image(self, angle):
+        """Rotates the image by the given angle, as far as the level of detail needs."""
+        self.rotation = angle
+        if self.detail == DETAIL_LOW:
+            return
+        self.image = pg.transform.rotate(self.images[self.image_index], angle)
+        self.rect = self.image.get_rect(center=self.rect.center)
+        if self.detail == DETAIL_FULL:
+            self.mask = pg.mask.from_surface(self.image)
+    
 class AlienA(Alien):
     """An alien that moves like an alien from Space Invaders"""
     
@@ -241,9 +262,7 @@ class AlienB(Alien):
             angle = 360
         
         # Rotate image in the direction of movement
-        self.image = pg.transform.rotate(self.images[self.image_index], -angle - 90)
-        self.rect = self.image.get_rect(center=self.rect.center)
-        self.mask = pg.mask.from_surface(self.image)
+        self.rotate_image(-angle - 90)
     
     def new_target(self):
         """Determines a new position to which to move."""
@@ -290,9 +309,7 @@ class AlienC(Alien):
         self.pos.y += math.sin(angle) * self.speed
         
         # Rotate image in the direction of movement
-        self.image = pg.transform.rotate(self.images[self.image_index], -math.degrees(angle) - 90)
-        self.rect = self.image.get_rect(center=self.rect.center)
-        self.mask = pg.mask.from_surface(self.image)
+        self.rotate_image(-math.degrees(angle) - 90)
         
 
 class Asteroid(Obstacle):
@@ -346,10 +363,14 @@ class Asteroid(Obstacle):
         # Move the asteroid to the opposite side if out of bounds
         self.move_to_opposite_side()
         
-        # Rotate
+        # Rotate, as far as the level of detail needs
         self.rotation += self.rotation_amt
+        if self.detail == DETAIL_LOW:
+            self.rect.center = self.pos.xy()
+            return
         self.image = pg.transform.rotate(self.images[self.image_index], self.rotation)
-        self.mask = pg.mask.from_surface(self.image)
+        if self.detail == DETAIL_FULL:
+            self.mask = pg.mask.from_surface(self.image)
         
         # Position the asteroid's rectangle on the screen
         self.rect = self.image.get_rect(center=self.pos.xy())
@@ -389,4 +410,34 @@ class AsteroidL(Asteroid):
             piece = AsteroidM(self.groups())
             piece.pos = geometry.Position(self.pos.x, self.pos.y)
             piece.angle = random.uniform(laser_angle - math.pi/2, laser_angle + math.pi/2)
-        super().kill()
\ No newline at end of file
+        super().kill()
+
+
+def update_detail(obstacles, targets):
+    """Decides the level of detail each obstacle is updated with: full detail
+    near any of the targets (the player and lasers), enough to be drawn on
+    screen, and only moving off screen. Distances are measured to the path
+    each target moves along in its next update, since a fast laser can
+    travel further than DETAIL_DISTANCE in one tick."""
+    paths = [target.next_path for target in targets]
+    max_distance = DETAIL_DISTANCE**2
+    for obs in obstacles:
+        x, y = obs.pos.xy()
+        if any(path_distance(x, y, path) < max_distance for path in paths):
+            obs.detail = DETAIL_FULL
+        elif obs.rect.colliderect(obs.area.get_rect().inflate(DETAIL_MARGIN * 2, DETAIL_MARGIN * 2)):
+            obs.detail = DETAIL_VISIBLE
+        else:
+            obs.detail = DETAIL_LOW
+
+def path_distance(x, y, path):
+    """Returns the squared distance from a point to a path from (x0, y0) to (x1, y1)."""
+    px, py = geometry.closest_point(x, y, path)
+    return (x - px)**2 + (y - py)**2
+
+def detailed(collided):
+    """Wraps a collision test so that it only tests obstacles in full detail,
+    which are the only ones with up to date masks."""
+    def collide(obs, sprite):
+        return obs.detail == DETAIL_FULL and collided(obs, sprite)
+    return collide
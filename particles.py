@@ -0,0 +1,87 @@
+"""A particle system for explosions and exhaust"""
+
+import math
+import numpy as np
+import pygame as pg
+
+PARTICLE_SIZE = 3 # px, size of a new particle, which shrinks as it ages
+DRAG = 0.95 # Fraction of its speed a particle keeps each update
+
+class ParticleSystem():
+    """A fixed number of particles kept in preallocated arrays, which are
+    advanced and drawn all at once rather than as a sprite each"""
+
+    def __init__(self, capacity, seed=None):
+        """Initializes a system that holds up to capacity particles."""
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.life = np.zeros(capacity) # Updates left, dead at 0
+        self.max_life = np.ones(capacity)
+        self.color = np.zeros(capacity, dtype=np.intp)
+        self.next = 0 # Slot of the next particle, overwriting the oldest when full
+        self.rng = np.random.default_rng(seed)
+
+        # Images of every size for each color used
+        self.colors = {}
+        self.images = []
+
+    def emit(self, x, y, count, speed, life, color, direction=0.0, spread=2 * math.pi):
+        """Emits particles from a point with random speeds up to speed,
+        in a cone of angle spread around direction (in radians)."""
+        count = min(count, self.capacity)
+        slots = (self.next + np.arange(count)) % self.capacity
+        self.next = (self.next + count) % self.capacity
+
+        angles = direction + self.rng.uniform(-spread / 2, spread / 2, count)
+        speeds = speed * self.rng.uniform(0.3, 1, count)
+        lives = np.maximum(life * self.rng.uniform(0.5, 1, count), 1)
+        self.pos[slots] = x, y
+        self.velocity[slots, 0] = np.cos(angles) * speeds
+        self.velocity[slots, 1] = np.sin(angles) * speeds
+        self.life[slots] = lives
+        self.max_life[slots] = lives
+        self.color[slots] = self.color_index(color)
+
+    def update(self):
+        """Moves, slows down and ages every particle."""
+        self.pos += self.velocity
+        self.velocity *= DRAG
+        self.life -= 1
+        np.maximum(self.life, 0, out=self.life)
+
+    def draw(self, surface):
+        """Draws the living particles onto a surface in a single batch."""
+        alive = np.flatnonzero(self.life)
+        if alive.size == 0:
+            return
+
+        # Particles shrink as they age
+        sizes = np.ceil(self.life[alive] / self.max_life[alive] * PARTICLE_SIZE).astype(np.intp)
+        image_indices = self.color[alive] * PARTICLE_SIZE + sizes - 1
+        positions = (self.pos[alive] - sizes[:, np.newaxis] / 2).astype(np.intp)
+
+        sequence = zip(map(self.images.__getitem__, image_indices.tolist()), positions.tolist())
+        if hasattr(surface, 'fblits'):
+            surface.fblits(sequence)
+        else:
+            surface.blits(sequence, False)
+
+    def clear(self):
+        """Removes all particles."""
+        self.life[:] = 0
+
+    def reseed(self, seed=None):
+        """Restarts the random numbers, so that a replayed game emits the same particles."""
+        self.rng = np.random.default_rng(seed)
+
+    def color_index(self, color):
+        """Returns the index of a color, creating its images the first time."""
+        index = self.colors.get(color)
+        if index is None:
+            index = self.colors[color] = len(self.colors)
+            for size in range(1, PARTICLE_SIZE + 1):
+                image = pg.surface.Surface((size, size))
+                image.fill(color)
+                self.images.append(image)
+        return index
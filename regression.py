@@ -0,0 +1,271 @@
+"""Replays the recorded games in the replays directory headless, checks that
+they end the same way as when they were recorded, and compares their tick
+times, peak memory and the pixels of the sprites' images and masks
+allocated per tick against a stored baseline.
+
+Exits with a non-zero status if a replay does not match or is slower or uses
+more memory than the baseline allows, so that it can be run before merging
+changes to the game loop or sprites. Tick times depend on the machine, so
+store a baseline on it before making changes:
+
+    python regression.py
+    python regression.py --update-baseline
+    python regression.py --record-scripted NAME --seed 7 --ticks 3600
+"""
+
+import os
+# Run without a window or sound device
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import glob
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import geometry
+import main as game
+import obstacle
+import replay
+import spaceship
+import telemetry
+
+REPLAY_DIR = 'replays'
+BASELINE_FILE = os.path.join(REPLAY_DIR, 'baseline.json')
+TIME_TOLERANCE = 0.5 # Fraction by which tick time percentiles may exceed the baseline
+MEMORY_TOLERANCE = 0.10 # Fraction by which the memory measurements may exceed the baseline
+MEMORY_KEYS = ('peak_memory', 'peak_pixel_memory', 'pixel_bytes_per_tick')
+REPEATS = 5 # Times each replay is timed, keeping the fastest
+PERCENTILES = (50, 95, 99)
+SNAPSHOT_TICKS = 37 # Ticks played after taking a snapshot before restoring it
+# Game state that a snapshot has to restore exactly
+SNAPSHOT_STATE = ('spawn_time_left', 'reload_time_left', 'spawn_rate', 'game_time',
+        'alien_animation_time_left', 'exhaust_animation_time_left', 'reloading', 'ammo',
+        'alien_image_index', 'exhaust_image_index', 'score')
+# Laser speeds, in px per tick, and how far ahead of the laser an obstacle is
+# placed that the laser reaches within one tick
+FAST_LASERS = ((300, 250), (200, 180))
+
+
+def play(session, trace_memory=False, frames=None):
+    """Plays a session through, passing each frame drawn to a FrameCapture
+    if one is given. Returns the outcome, the time of each tick in seconds
+    and, if trace_memory is true, the memory measurements to compare against
+    the baseline. These count the pixels of the sprites' images and masks,
+    which SDL allocates out of sight of tracemalloc."""
+    game.new_game(session.seed)
+    if trace_memory:
+        tracemalloc.start()
+    tick_times = []
+    pixels = telemetry.MemoryTelemetry()
+    peak_pixels = replaced_pixels = 0
+    for keystate, shots in session.inputs():
+        if not game.player.alive():
+            break
+        for _ in range(shots):
+            game.shoot()
+        game.keystate = keystate
+        start = time.perf_counter()
+        game.simulate_tick()
+        game.draw_game()
+        tick_times.append(time.perf_counter() - start)
+        if trace_memory:
+            peak_pixels = max(peak_pixels, pixel_bytes(telemetry.pixel_memory(game.sprites)))
+            replaced_pixels += pixel_bytes(pixels.replaced_pixels(game.sprites))
+        if frames is not None:
+            frames.capture(game.screen, block=True)
+        # Nothing plays the sounds, so throw them away
+        while not game.sound_queue.empty():
+            game.sound_queue.get_nowait()
+    memory = {}
+    if trace_memory:
+        memory['peak_memory'] = tracemalloc.get_traced_memory()[1] + peak_pixels
+        memory['peak_pixel_memory'] = peak_pixels
+        memory['pixel_bytes_per_tick'] = replaced_pixels // max(len(tick_times), 1)
+        tracemalloc.stop()
+    game.recorder.cancel()
+    return dict(game.outcome(), ticks=len(tick_times)), tick_times, memory
+
+def pixel_bytes(usage):
+    """Returns the total bytes of images and masks counted by sprite class."""
+    return sum(counts['surface'] + counts['mask'] for counts in usage.values())
+
+def measure(session, repeats):
+    """Replays a session. Returns its outcome and performance numbers."""
+    results = {}
+    for _ in range(repeats):
+        outcome, tick_times, _ = play(session)
+        quantiles = statistics.quantiles(tick_times, n=100)
+        for p in PERCENTILES:
+            key = f'p{p}_ms'
+            value = quantiles[p - 1] * 1000
+            results[key] = min(results.get(key, value), value)
+    # Tracing memory slows the game down, so it is measured in a separate run
+    _, _, memory = play(session, trace_memory=True)
+    results.update(memory)
+    return outcome, results
+
+def check_snapshot(session):
+    """Takes a snapshot halfway through a session and restores it after
+    playing on, then checks that the world was recreated exactly.
+    Returns a list of problems."""
+    game.new_game(session.seed)
+    inputs = list(session.inputs())
+    half = len(inputs) // 2
+    world = state = None
+    for tick, (keystate, shots) in enumerate(inputs):
+        if tick == half:
+            world = game.capture_world()
+            state = {name: getattr(game, name) for name in SNAPSHOT_STATE}
+        if not game.player.alive() or tick == half + SNAPSHOT_TICKS:
+            break
+        for _ in range(shots):
+            game.shoot()
+        game.keystate = keystate
+        game.simulate_tick()
+        while not game.sound_queue.empty():
+            game.sound_queue.get_nowait()
+    if world is None:
+        return []
+    game.restore_world(world)
+
+    problems = []
+    for name, value in state.items():
+        if getattr(game, name) != value:
+            problems.append(f'{name} {getattr(game, name)} != {value} after restoring a snapshot')
+    if game.capture_world() != world:
+        problems.append('sprites differ after restoring a snapshot')
+    return problems
+
+def check_fast_lasers():
+    """Shoots lasers fast enough to reach an obstacle beyond DETAIL_DISTANCE
+    within one tick, and checks that they still hit it. Returns a list of problems."""
+    problems = []
+    laser_speed = spaceship.LASER_SPEED
+    try:
+        for speed, distance in FAST_LASERS:
+            spaceship.LASER_SPEED = speed
+            game.new_game(0)
+            game.spawn_time_left = float('inf')
+            game.player.velocity.direction = 0.0
+            game.shoot()
+            laser, = game.lasers
+            target = obstacle.AsteroidS(game.sprites, game.obstacles, game.asteroids)
+            target.pos = geometry.Position(laser.pos.x + distance, laser.pos.y)
+            target.speed = 0
+            target.rect.center = target.pos.xy()
+            game.simulate_tick()
+            while not game.sound_queue.empty():
+                game.sound_queue.get_nowait()
+            if target.alive():
+                problems.append(f'a laser moving {speed} px per tick passed through an obstacle {distance} px ahead')
+            game.recorder.cancel()
+    finally:
+        spaceship.LASER_SPEED = laser_speed
+    return problems
+
+def record_scripted(name, seed, ticks):
+    """Records a session from scripted input that holds down random keys
+    for random lengths of time and shoots now and then."""
+    script = random.Random(seed)
+    game.new_game(seed)
+    keystate = replay.decode_keys(0)
+    hold = 0
+    for _ in range(ticks):
+        if not game.player.alive():
+            break
+        if hold <= 0:
+            keystate = replay.decode_keys(script.choice((0b0001, 0b0101, 0b1001, 0b0001, 0b0000, 0b0010)))
+            hold = script.randint(10, 90)
+        hold -= 1
+        if game.ammo > 0 and script.random() < 0.05:
+            game.shoot()
+        game.keystate = keystate
+        game.simulate_tick()
+        while not game.sound_queue.empty():
+            game.sound_queue.get_nowait()
+    # The recording already finished if the player died
+    game.recorder.finish(game.outcome())
+    session = game.recorder.last_session
+    filename = os.path.join(REPLAY_DIR, name + '.json')
+    session.save(filename)
+    print(f'Recorded {filename}: {session.outcome}')
+
+def check(args):
+    """Replays every session and compares it against its outcome and the baseline.
+    Returns whether all sessions passed."""
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as file:
+            baseline = json.load(file)
+
+    passed = True
+    for problem in check_fast_lasers():
+        print(f'REGRESSION: {problem}')
+        passed = False
+    new_baseline = {}
+    for filename in sorted(glob.glob(os.path.join(REPLAY_DIR, '*.json'))):
+        if filename == BASELINE_FILE:
+            continue
+        name = os.path.splitext(os.path.basename(filename))[0]
+        session = replay.Session.load(filename)
+        if session.fps != game.FPS:
+            print(f'{name}: recorded at {session.fps} FPS but the game runs at {game.FPS} FPS')
+            passed = False
+            continue
+
+        outcome, results = measure(session, args.repeats)
+        new_baseline[name] = results
+        problems = []
+        if outcome != session.outcome:
+            problems.append(f'outcome {outcome} != recorded {session.outcome}')
+        problems.extend(check_snapshot(session))
+        if name in baseline:
+            for p in PERCENTILES:
+                key = f'p{p}_ms'
+                limit = baseline[name][key] * (1 + args.time_tolerance)
+                if results[key] > limit:
+                    problems.append(f'{key} {results[key]:.3f} > {limit:.3f}')
+            for key in MEMORY_KEYS:
+                limit = baseline[name].get(key, 0) * (1 + args.memory_tolerance)
+                if results[key] > limit:
+                    problems.append(f'{key.replace("_", " ")} {results[key]} > {limit:.0f}')
+
+        summary = ', '.join(f'p{p} {results[f"p{p}_ms"]:.3f} ms' for p in PERCENTILES)
+        print(f'{name}: {outcome["ticks"]} ticks, {summary}, peak {results["peak_memory"]} B '
+                f'({results["peak_pixel_memory"]} B of pixels), {results["pixel_bytes_per_tick"]} B of pixels per tick')
+        for problem in problems:
+            print(f'  REGRESSION: {problem}')
+        passed = passed and not problems
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, 'w') as file:
+            json.dump(new_baseline, file, indent=1)
+        print(f'Updated {BASELINE_FILE}')
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded games and check for regressions.')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--update-baseline', action='store_true',
+            help='store the measurements as the new baseline')
+    parser.add_argument('--record-scripted', metavar='NAME',
+            help='record a new session from scripted input instead of checking')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ticks', type=int, default=3600)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    game.init_game(headless=True)
+    if args.record_scripted:
+        record_scripted(args.record_scripted, args.seed, args.ticks)
+        return 0
+    return 0 if check(args) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Recording and playback of the input of a game, so that it can be replayed exactly"""
+
+import collections
+import json
+from pygame.locals import *
+
+# Keys that are held down to move, stored as bits in this order
+KEYS = (K_UP, K_DOWN, K_LEFT, K_RIGHT)
+
+
+class Session():
+    """The input of a game tick by tick, along with its seed and outcome"""
+
+    def __init__(self, seed, fps, keys=None, shots=None, outcome=None):
+        """Initializes a session.
+        keys is a list of [tick, bits] pairs for each tick the held keys changed,
+        and shots is a list of the ticks before which the player shot."""
+        self.seed = seed
+        self.fps = fps
+        self.keys = [] if keys is None else keys
+        self.shots = [] if shots is None else shots
+        self.outcome = outcome
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a session from a file."""
+        with open(filename) as file:
+            return cls(**json.load(file))
+
+    def save(self, filename):
+        """Saves the session to a file."""
+        with open(filename, 'w') as file:
+            json.dump(vars(self), file)
+
+    def inputs(self):
+        """Yields the keys held down (as a mapping like pg.key.get_pressed())
+        and the number of shots fired before each tick."""
+        shots = collections.Counter(self.shots)
+        changes = iter(self.keys)
+        change = next(changes, None)
+        keystate = decode_keys(0)
+        for tick in range(self.outcome['ticks']):
+            while change is not None and change[0] <= tick:
+                keystate = decode_keys(change[1])
+                change = next(changes, None)
+            yield keystate, shots[tick]
+
+
+class Recorder():
+    """Records the input of a game tick by tick"""
+
+    def __init__(self):
+        self.session = None
+        self.last_session = None # Session that was finished last
+
+    def start(self, seed, fps):
+        """Starts recording a new game."""
+        self.session = Session(seed, fps)
+        self.ticks = 0
+        self.bits = None
+
+    def cancel(self):
+        """Stops recording without keeping the recording."""
+        self.session = None
+
+    def tick(self, keystate):
+        """Records the keys held down during a tick."""
+        if self.session is None:
+            return
+        bits = encode_keys(keystate)
+        if bits != self.bits:
+            self.session.keys.append([self.ticks, bits])
+            self.bits = bits
+        self.ticks += 1
+
+    def shot(self):
+        """Records a shot before the next tick."""
+        if self.session is not None:
+            self.session.shots.append(self.ticks)
+
+    def finish(self, outcome):
+        """Stops recording. Returns the recorded session, or None if not recording."""
+        session = self.session
+        if session is not None:
+            session.outcome = dict(outcome, ticks=self.ticks)
+            self.last_session = session
+        self.session = None
+        return session
+
+
+def encode_keys(keystate):
+    """Returns the bits of the movement keys held down."""
+    bits = 0
+    for i, key in enumerate(KEYS):
+        if keystate[key]:
+            bits |= 1 << i
+    return bits
+
+def decode_keys(bits):
+    """Returns a mapping of the movement keys held down from their bits."""
+    keystate = collections.defaultdict(bool)
+    for i, key in enumerate(KEYS):
+        keystate[key] = bool(bits & (1 << i))
+    return keystate
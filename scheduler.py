@@ -0,0 +1,43 @@
+"""Deadline-based pacing for the cooperating tasks of the game loop"""
+
+import asyncio
+
+MAX_CATCH_UP = 5 # Most ticks run back to back after falling behind
+
+
+class Ticker():
+    """Paces a task to a fixed rate by sleeping until deadlines
+    instead of blocking the event loop"""
+
+    def __init__(self, rate):
+        """Initializes a ticker that ticks rate times per second."""
+        self.period = 1 / rate
+        self.deadline = None
+
+    def reset(self):
+        """Forgets the previous deadline, e.g. after the task was idle."""
+        self.deadline = None
+
+    async def wait(self):
+        """Sleeps until the next deadline. Returns the number of ticks that
+        are due, which is more than one if the task fell behind."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline += self.period
+        delay = self.deadline - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+            return 1
+
+        # Catch up on missed ticks, but drop them if too far behind
+        ticks = 1 + int(-delay / self.period)
+        if ticks > MAX_CATCH_UP:
+            ticks = MAX_CATCH_UP
+            self.deadline = now
+        else:
+            self.deadline += (ticks - 1) * self.period
+        # Still give the other tasks a turn
+        await asyncio.sleep(0)
+        return ticks
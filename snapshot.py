@@ -0,0 +1,211 @@
+"""Compact binary snapshots of the game world and a ring buffer to hold them"""
+
+import collections
+import math
+import struct
+import pygame as pg
+import geometry
+import obstacle
+import spaceship
+
+# Timers from the main loop that are saved along with the sprites
+Timers = collections.namedtuple('Timers', ('spawn_time_left', 'reload_time_left',
+        'spawn_rate', 'elapsed_time', 'alien_animation_time_left', 'exhaust_animation_time_left',
+        'reloading', 'ammo', 'alien_image_index', 'exhaust_image_index', 'score'))
+
+# spawn time left, reload time left, spawn rate, elapsed time, alien animation
+# time left, exhaust animation time left, reloading, ammo, alien image index,
+# exhaust image index, score, number of records
+HEADER = struct.Struct('<ddddddBBBBIH')
+# type, image index, offscreen position, direction 1, direction 2, flag,
+# x, y, heading, rotation, speed, auxiliary value
+RECORD = struct.Struct('<BBBBBBdddddd')
+
+# Type codes of the sprites that are saved (the exhaust belongs to the spaceship)
+TYPES = (
+    spaceship.Spaceship,
+    spaceship.Laser,
+    obstacle.AlienA,
+    obstacle.AlienB,
+    obstacle.AlienC,
+    obstacle.AsteroidS,
+    obstacle.AsteroidM,
+    obstacle.AsteroidL,
+    )
+CODES = {clazz: code for code, clazz in enumerate(TYPES)}
+POINTS = {
+    obstacle.AlienA: obstacle.ALIEN_A_POINTS,
+    obstacle.AlienB: obstacle.ALIEN_B_POINTS,
+    obstacle.AlienC: obstacle.ALIEN_C_POINTS,
+    obstacle.AsteroidS: obstacle.ASTEROID_POINTS,
+    obstacle.AsteroidM: obstacle.ASTEROID_POINTS,
+    obstacle.AsteroidL: obstacle.ASTEROID_POINTS,
+    }
+
+# Directions are stored by value, with 0 meaning no direction
+DIRECTIONS = (None,) + tuple(geometry.Direction)
+
+# Masks of the unrotated images, shared by restored sprites
+masks = {}
+
+
+class SnapshotBuffer():
+    """A fixed-size ring buffer of snapshots taken at a regular interval"""
+
+    def __init__(self, capacity, interval):
+        """Initializes an empty buffer that holds up to capacity snapshots."""
+        self.snapshots = collections.deque(maxlen=capacity)
+        self.interval = interval
+        self.time_left = 0
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def advance(self, seconds):
+        """Counts down the snapshot timer. Returns whether a snapshot is due."""
+        self.time_left -= seconds
+        if self.time_left <= 0:
+            self.time_left = self.interval
+            return True
+        return False
+
+    def push(self, snapshot):
+        """Adds a snapshot, overwriting the oldest one if the buffer is full."""
+        self.snapshots.append(snapshot)
+
+    def pop(self):
+        """Removes and returns the latest snapshot, or None if there are none."""
+        if not self.snapshots:
+            return None
+        self.time_left = self.interval
+        return self.snapshots.pop()
+
+    def clear(self):
+        """Removes all snapshots."""
+        self.snapshots.clear()
+        self.time_left = 0
+
+
+def capture(timers, player, sprites):
+    """Packs the timers, the player and every other sprite into a snapshot."""
+    records = [pack_sprite(player)]
+    for sprite in sprites:
+        if sprite is not player and type(sprite) in CODES:
+            records.append(pack_sprite(sprite))
+    header = HEADER.pack(*timers, len(records))
+    return header + b''.join(records)
+
+def restore(snapshot, sprites, playergroup, obstacles, aliens, asteroids, lasers):
+    """Recreates the sprites of a snapshot in the given (empty) groups.
+    Returns the timers and the player."""
+    header = HEADER.unpack_from(snapshot)
+    timers = Timers(*header[:6], bool(header[6]), *header[7:11])
+    player = None
+    for record in RECORD.iter_unpack(memoryview(snapshot)[HEADER.size:]):
+        clazz = TYPES[record[0]]
+        if clazz is spaceship.Spaceship:
+            player = unpack_spaceship(record, sprites, playergroup)
+        elif clazz is spaceship.Laser:
+            unpack_laser(record, sprites, lasers)
+        elif issubclass(clazz, obstacle.Alien):
+            unpack_obstacle(clazz, record, player, sprites, obstacles, aliens)
+        else:
+            unpack_obstacle(clazz, record, player, sprites, obstacles, asteroids)
+    return timers, player
+
+def pack_sprite(sprite):
+    """Packs a single sprite into a record."""
+    clazz = type(sprite)
+    code = CODES[clazz]
+    x, y = sprite.pos.xy()
+    if clazz is spaceship.Spaceship:
+        return RECORD.pack(code, sprite.exhaust.image_index, 0, 0, 0, 0, x, y,
+                sprite.velocity.direction, 0, sprite.velocity.magnitude, 0)
+    if clazz is spaceship.Laser:
+        return RECORD.pack(code, 0, 0, 0, 0, 0, x, y,
+                sprite.angle, 0, 0, sprite.distance_left)
+    offscreen = direction_code(sprite.offscreen_position)
+    if clazz is obstacle.AlienA:
+        return RECORD.pack(code, sprite.image_index, offscreen,
+                direction_code(sprite.descend_direction), direction_code(sprite.end_direction),
+                sprite.to_end, x, y, 0, 0, sprite.speed, sprite.to_descend)
+    if clazz is obstacle.AlienB:
+        return RECORD.pack(code, sprite.image_index, offscreen,
+                direction_code(sprite.direction), 0, 0, x, y, 0, 0, sprite.speed, sprite.distance)
+    if clazz is obstacle.AlienC:
+        # The flag records that the alien is homing in on the player
+        return RECORD.pack(code, sprite.image_index, offscreen, 0, 0, 1, x, y,
+                0, 0, sprite.speed, 0)
+    # Asteroid
+    return RECORD.pack(code, sprite.image_index, offscreen, 0, 0, 0, x, y,
+            sprite.angle, sprite.rotation, sprite.speed, sprite.rotation_amt)
+
+def unpack_spaceship(record, sprites, playergroup):
+    """Recreates the spaceship from a record."""
+    _, exhaust_index, _, _, _, _, x, y, heading, _, speed, _ = record
+    player = spaceship.Spaceship((x, y), heading, sprites, playergroup)
+    player.velocity.magnitude = speed
+    player.exhaust.image_index = exhaust_index
+    player.exhaust.update()
+    return player
+
+def unpack_laser(record, sprites, lasers):
+    """Recreates a laser from a record."""
+    _, _, _, _, _, _, x, y, angle, _, _, distance_left = record
+    laser = blank_sprite(spaceship.Laser, sprites, lasers)
+    laser.angle = angle
+    laser.pos = geometry.Position(x, y)
+    laser.distance_left = distance_left
+    laser.path = laser.pos.xy() + laser.pos.xy()
+    laser.image = pg.transform.rotate(spaceship.Laser.images[0], -90.0 - math.degrees(angle))
+    laser.rect = laser.image.get_rect(center=laser.pos.xy())
+    laser.mask = pg.mask.from_surface(laser.image)
+    return laser
+
+def unpack_obstacle(clazz, record, player, *groups):
+    """Recreates an alien or asteroid from a record."""
+    _, image_index, offscreen, direction1, direction2, flag, x, y, \
+        heading, rotation, speed, aux = record
+    sprite = blank_sprite(clazz, *groups)
+    sprite.pos = geometry.Position(x, y)
+    sprite.offscreen_position = DIRECTIONS[offscreen]
+    sprite.image_index = image_index
+    sprite.speed = speed
+    sprite.points = POINTS[clazz]
+    if clazz is obstacle.AlienA:
+        sprite.descend_direction = DIRECTIONS[direction1]
+        sprite.end_direction = DIRECTIONS[direction2]
+        sprite.to_end = bool(flag)
+        sprite.to_descend = aux
+        sprite.reached_end = False
+    elif clazz is obstacle.AlienB:
+        sprite.direction = DIRECTIONS[direction1]
+        sprite.distance = aux
+    elif clazz is obstacle.AlienC:
+        sprite.player = player
+    else:
+        sprite.angle = heading
+        sprite.rotation = rotation
+        sprite.rotation_amt = aux
+    # Start from the unrotated image, since the next update rotates it anyway
+    sprite.image = clazz.images[image_index]
+    sprite.rect = sprite.image.get_rect(center=sprite.pos.xy())
+    sprite.mask = image_mask(sprite.image)
+    return sprite
+
+def image_mask(image):
+    """Returns the mask of an unrotated image, building it only the first time."""
+    mask = masks.get(image)
+    if mask is None:
+        mask = masks[image] = pg.mask.from_surface(image)
+    return mask
+
+def blank_sprite(clazz, *groups):
+    """Creates a sprite without running its initializer, which would randomize it."""
+    sprite = clazz.__new__(clazz)
+    pg.sprite.Sprite.__init__(sprite, *groups)
+    return sprite
+
+def direction_code(direction):
+    """Returns the value used to store a direction."""
+    return 0 if direction is None else direction.value
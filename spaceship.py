@@ -15,10 +15,10 @@ class Spaceship(pg.sprite.Sprite):
     """A spaceship that can move and shoot"""
     
     images = []
+    area = None # Surface the spaceship moves around on
     
     def __init__(self, pos=(0, 0), direction=0.0, sprite_group=None, *groups):
         super().__init__(sprite_group, groups)
-        self.area = pg.display.get_surface()
         
         self.pos = geometry.Position(pos[0], pos[1])
         self.velocity = geometry.Vector(0, direction)
@@ -81,6 +81,13 @@ class Spaceship(pg.sprite.Sprite):
         
         # Update exhaust
         self.exhaust.update()
+    
+    @property
+    def next_path(self):
+        """Start and end of the path the spaceship will move along in its next update."""
+        x, y = self.pos.xy()
+        a, b = self.velocity.ab()
+        return x, y, x + a, y + b
         
         
 class Exhaust(pg.sprite.Sprite):
@@ -122,16 +129,18 @@ class Laser(pg.sprite.Sprite):
     """Represents a projectile that can be fired at obstacles"""
     
     images = []
+    area = None # Surface the laser moves around on
     
     def __init__(self, spaceship, *groups):
         super().__init__(groups)
-        self.area = pg.display.get_surface()
         
         self.angle = math.radians(spaceship.velocity.direction)
         self.pos = geometry.Position(spaceship.pos.x, spaceship.pos.y)
         self.pos.x += math.cos(self.angle) * (spaceship.image.get_height() / 2)
         self.pos.y += math.sin(self.angle) * (spaceship.image.get_height() / 2)
         self.distance_left = LASER_TRAVEL_DISTANCE;
+        # Start and end of the path swept in the last update
+        self.path = self.pos.xy() + self.pos.xy()
         
         self.images = [pg.transform.rotate(image, -90.0) for image in self.images]
         self.image = pg.transform.rotate(self.images[0], -spaceship.velocity.direction)
@@ -148,8 +157,10 @@ class Laser(pg.sprite.Sprite):
         
         # Otherwise, position the laser's rectangle on the screen
         else:
+            start = self.pos.xy()
             self.pos.x += math.cos(self.angle) * LASER_SPEED
             self.pos.y += math.sin(self.angle) * LASER_SPEED
+            self.path = start + self.pos.xy()
             self.rect.center = self.pos.xy()
             # Move the laser to the opposite side if out of bounds
             if not self.area.get_rect().collidepoint(self.pos.xy()):
@@ -157,4 +168,33 @@ class Laser(pg.sprite.Sprite):
                 elif self.pos.x < 0: self.pos.x = self.area.get_width()
                 if self.pos.y > self.area.get_height(): self.pos.y = 0
                 elif self.pos.y < 0: self.pos.y = self.area.get_height()
-            
\ No newline at end of file
+    
+    @property
+    def next_path(self):
+        """Start and end of the path the laser will sweep in its next update."""
+        x, y = self.pos.xy()
+        return x, y, x + math.cos(self.angle) * LASER_SPEED, y + math.sin(self.angle) * LASER_SPEED
+    
+    @property
+    def sweep(self):
+        """The rectangle around the area swept along the path of the last update."""
+        x0, y0, x1, y1 = self.path
+        width, height = self.rect.size
+        return pg.Rect(int(min(x0, x1) - width / 2), int(min(y0, y1) - height / 2),
+                int(abs(x1 - x0)) + width + 2, int(abs(y1 - y0)) + height + 2)
+
+
+def collide_laser(sprite, laser):
+    """Collision test between a sprite and the path the laser swept along in
+    its last update, so that a laser cannot pass through a sprite between
+    two frames. The path is tested against the bounding circles of the two
+    first, and the masks only with the laser at the point of the path
+    closest to the sprite."""
+    x, y = sprite.rect.center
+    px, py = geometry.closest_point(x, y, laser.path)
+    radius = (math.hypot(*sprite.rect.size) + math.hypot(*laser.rect.size)) / 2
+    if (x - px)**2 + (y - py)**2 > radius**2:
+        return False
+    width, height = laser.rect.size
+    offset = (round(px - width / 2) - sprite.rect.x, round(py - height / 2) - sprite.rect.y)
+    return sprite.mask.overlap(laser.mask, offset) is not None
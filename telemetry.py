@@ -0,0 +1,172 @@
+"""Opt-in instrumentation of memory use per frame and per sprite class"""
+
+import collections
+import contextlib
+import gc
+import json
+import logging
+import logging.handlers
+import threading
+import time
+import tracemalloc
+import pygame as pg
+
+LOG_MAX_BYTES = 1000000 # Size at which the log rolls over to a new file
+LOG_BACKUPS = 3 # Number of old log files kept
+REPORT_INTERVAL = 60 # Frames between reports of live instances and pixel memory
+
+
+class MemoryTelemetry():
+    """Measures the bytes allocated by each subsystem per frame with tracemalloc,
+    the pixel bytes of the sprite images and masks replaced each frame (which
+    SDL allocates where tracemalloc cannot see them) and garbage collection
+    pauses with gc callbacks, and writes them to a rolling log"""
+
+    def __init__(self, filename=None):
+        """Initializes the telemetry, which is disabled unless a log file is given."""
+        self.enabled = filename is not None
+        self.frame = 0
+        self.allocated = collections.defaultdict(int)
+        self.gc_pauses = []
+        self.gc_start = None
+        self.previous = {} # Image and mask of each sprite in the last frame
+        # Held by the open section, and by other threads while they allocate,
+        # since tracemalloc counts the allocations of every thread
+        self.lock = threading.Lock()
+        if not self.enabled:
+            return
+
+        handler = logging.handlers.RotatingFileHandler(filename, maxBytes=LOG_MAX_BYTES,
+                backupCount=LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger = logging.getLogger('memory')
+        self.logger.addHandler(handler)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        tracemalloc.start()
+        gc.callbacks.append(self.on_gc)
+
+    def stop(self):
+        """Stops tracing and closes the log."""
+        if not self.enabled:
+            return
+        gc.callbacks.remove(self.on_gc)
+        tracemalloc.stop()
+        for handler in self.logger.handlers[:]:
+            handler.close()
+            self.logger.removeHandler(handler)
+        self.enabled = False
+
+    def section(self, name):
+        """Returns a context manager that counts the bytes allocated inside it
+        towards the named subsystem. Sections must not be nested."""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return Section(self, name)
+
+    def background(self):
+        """Returns a context manager for other threads to allocate inside,
+        which keeps their allocations out of the sections."""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.lock
+
+    def on_gc(self, phase, info):
+        """Times garbage collection pauses."""
+        if phase == 'start':
+            self.gc_start = time.perf_counter()
+        elif self.gc_start is not None:
+            pause = (time.perf_counter() - self.gc_start) * 1000
+            self.gc_pauses.append((info['generation'], round(pause, 3)))
+            self.gc_start = None
+
+    def end_frame(self, sprites):
+        """Writes the measurements of the frame to the log and starts a new frame."""
+        if not self.enabled:
+            return
+        record = {
+            'frame': self.frame,
+            'allocated': self.allocated,
+            'traced': tracemalloc.get_traced_memory()[0],
+            'gc_pauses_ms': self.gc_pauses,
+            'replaced_pixel_bytes': self.replaced_pixels(sprites),
+            }
+        if self.frame % REPORT_INTERVAL == 0:
+            record['instances'] = instance_counts()
+            record['pixel_bytes'] = pixel_memory(sprites)
+        self.logger.info(json.dumps(record))
+
+        self.frame += 1
+        self.allocated = collections.defaultdict(int)
+        self.gc_pauses = []
+
+    def replaced_pixels(self, sprites):
+        """Returns the bytes of the images and masks that sprites replaced since
+        the last frame, by sprite class."""
+        replaced = {}
+        current = {}
+        for sprite in sprites:
+            image = getattr(sprite, 'image', None)
+            mask = getattr(sprite, 'mask', None)
+            current[sprite] = (image, mask)
+            last_image, last_mask = self.previous.get(sprite, (None, None))
+            surface_bytes = 0 if image is None or image is last_image else surface_size(image)
+            mask_bytes = 0 if mask is None or mask is last_mask else mask_size(mask)
+            if surface_bytes or mask_bytes:
+                usage = replaced.setdefault(type(sprite).__name__, {'surface': 0, 'mask': 0})
+                usage['surface'] += surface_bytes
+                usage['mask'] += mask_bytes
+        # Holding on to the last images keeps their ids from being reused
+        self.previous = current
+        return replaced
+
+
+class Section():
+    """Context manager that measures the bytes allocated inside it"""
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self):
+        self.telemetry.lock.acquire()
+        tracemalloc.reset_peak()
+        self.start = tracemalloc.get_traced_memory()[0]
+
+    def __exit__(self, *exc_info):
+        # The peak counts memory that was allocated and freed again inside the section
+        peak = tracemalloc.get_traced_memory()[1]
+        self.telemetry.allocated[self.name] += peak - self.start
+        self.telemetry.lock.release()
+        return False
+
+
+def instance_counts():
+    """Returns the number of live instances of each sprite class,
+    including sprites that were killed but are still referenced."""
+    counts = collections.Counter(type(obj).__name__ for obj in gc.get_objects()
+            if isinstance(obj, pg.sprite.Sprite))
+    return dict(counts)
+
+def pixel_memory(sprites):
+    """Returns the bytes used by the images and masks of the sprites in a group,
+    by sprite class."""
+    memory = {}
+    for sprite in sprites:
+        usage = memory.setdefault(type(sprite).__name__, {'surface': 0, 'mask': 0})
+        image = getattr(sprite, 'image', None)
+        if image is not None:
+            usage['surface'] += surface_size(image)
+        mask = getattr(sprite, 'mask', None)
+        if mask is not None:
+            usage['mask'] += mask_size(mask)
+    return memory
+
+def surface_size(surface):
+    """Returns the bytes of the pixels of a surface."""
+    return surface.get_pitch() * surface.get_height()
+
+def mask_size(mask):
+    """Returns the bytes of the bits of a mask."""
+    width, height = mask.get_size()
+    return width * height // 8
@@ -0,0 +1,388 @@
+"""Optional mode that runs the simulation in a separate process, which publishes
+the sprites to draw and the sounds and particles to play through shared memory"""
+
+import collections
+import math
+import multiprocessing
+import os
+import time
+import numpy as np
+import pygame as pg
+import obstacle
+import replay
+import spaceship
+
+MAX_SPRITES = 1024 # Most sprites published per frame
+RING_CAPACITY = 256 # Most commands or events waiting to be taken
+STOP_TIMEOUT = 2 # s to wait for the simulation process to quit before stopping it harder
+POLL_RATE = 0.01 # s, how often the first frame or room for a command is checked for
+MAX_LAG = 0.25 # s the simulation may fall behind before it stops catching up
+ROTATION_STEPS = 64 # Angles that rotated images are drawn at
+SCALE_STEPS = 20 # Sizes per scale of 1 that scaled images are drawn at
+CACHE_SIZE = 512 # Most transformed images kept, dropping the least recently drawn
+
+# Sprites that are published, by type code
+TYPES = (
+    spaceship.Spaceship,
+    spaceship.Exhaust,
+    spaceship.Laser,
+    obstacle.AlienA,
+    obstacle.AlienB,
+    obstacle.AlienC,
+    obstacle.AsteroidS,
+    obstacle.AsteroidM,
+    obstacle.AsteroidL,
+    )
+CODES = {clazz: code for code, clazz in enumerate(TYPES)}
+
+# Commands sent from the main process
+SHOOT, PAUSE, RESUME, NEW_GAME, SAVE, LOAD, REWIND, QUIT = range(8)
+# Kinds of events sent from the simulation process
+SOUND, PARTICLES = range(2)
+
+SPRITE = np.dtype([('type', 'u1'), ('image', 'u1'), ('x', 'f4'), ('y', 'f4'),
+        ('rotation', 'f4'), ('scale', 'f4')], align=True)
+EVENT = np.dtype([('kind', 'u1'), ('id', 'u1'), ('count', 'u2'), ('x', 'f4'), ('y', 'f4'),
+        ('speed', 'f4'), ('life', 'f4'), ('direction', 'f4'), ('spread', 'f4')], align=True)
+COMMAND = np.dtype('u1')
+# Fields of the game state published with each frame
+STATE_FIELDS = ('count', 'score', 'alive', 'input_time')
+
+
+class Ring():
+    """A lock-free queue of records in shared memory for one producer and one
+    consumer, which counts the records that did not fit"""
+
+    def __init__(self, buffer, offset, dtype, capacity):
+        """Lays out the queue in a buffer at an offset."""
+        # Head and the number of records dropped are only written by the
+        # producer and tail only by the consumer
+        self.indices = np.ndarray(3, np.int64, buffer, offset)
+        self.records = np.ndarray(capacity, dtype, buffer, offset + self.indices.nbytes)
+        self.capacity = capacity
+
+    @staticmethod
+    def size(dtype, capacity):
+        """Returns the bytes needed for a queue."""
+        return align(3 * 8 + dtype.itemsize * capacity)
+
+    @property
+    def dropped(self):
+        """The number of records that were dropped because the queue was full."""
+        return int(self.indices[2])
+
+    def put(self, record):
+        """Adds a record. Returns False if the queue is full."""
+        head, tail, _ = self.indices
+        if head - tail >= self.capacity:
+            return False
+        self.records[head % self.capacity] = record
+        self.indices[0] = head + 1
+        return True
+
+    def offer(self, record):
+        """Adds a record, or counts it as dropped if the queue is full."""
+        if not self.put(record):
+            self.indices[2] += 1
+
+    def take(self):
+        """Removes and returns the waiting records."""
+        head, tail, _ = self.indices
+        records = self.records[np.arange(tail, head) % self.capacity]
+        self.indices[1] = head
+        return records
+
+
+class SharedState():
+    """The layout of the shared memory: the held keys, a double-buffered frame
+    of sprites and state, and the command and event queues"""
+
+    def __init__(self, buffer):
+        """Lays out the shared state in a buffer."""
+        # front frame, sequence of each frame, held keys
+        self.control = np.ndarray(4, np.int64, buffer, 0)
+        offset = self.control.nbytes
+        self.states = np.ndarray((2, len(STATE_FIELDS)), np.int64, buffer, offset)
+        offset += self.states.nbytes
+        self.sprites = np.ndarray((2, MAX_SPRITES), SPRITE, buffer, offset)
+        offset += align(self.sprites.nbytes)
+        self.commands = Ring(buffer, offset, COMMAND, RING_CAPACITY)
+        offset += Ring.size(COMMAND, RING_CAPACITY)
+        self.events = Ring(buffer, offset, EVENT, RING_CAPACITY)
+
+    @staticmethod
+    def size():
+        """Returns the bytes needed for the shared state."""
+        return (4 * 8 + 2 * len(STATE_FIELDS) * 8 + align(2 * MAX_SPRITES * SPRITE.itemsize)
+                + Ring.size(COMMAND, RING_CAPACITY) + Ring.size(EVENT, RING_CAPACITY))
+
+    def publish(self, sprites, state):
+        """Writes a frame into the back buffer and makes it the front buffer.
+        sprites is a list of SPRITE tuples."""
+        back = 1 - self.control[0]
+        count = min(len(sprites), MAX_SPRITES)
+        # An odd sequence number tells the reader that the frame is being written
+        self.control[1 + back] += 1
+        if count:
+            self.sprites[back, :count] = sprites[:count]
+        self.states[back] = (count,) + state
+        self.control[1 + back] += 1
+        self.control[0] = back
+
+    def read(self):
+        """Returns a copy of the sprites and state of the front frame."""
+        while True:
+            front = self.control[0]
+            sequence = self.control[1 + front]
+            if sequence % 2:
+                continue
+            state = self.states[front].copy()
+            sprites = self.sprites[front, :state[0]].copy()
+            # Read again if the frame was overwritten while copying it
+            if self.control[1 + front] == sequence:
+                return sprites, dict(zip(STATE_FIELDS, state.tolist()))
+
+
+class SimulationProcess():
+    """The simulation running in a separate process"""
+
+    def __init__(self):
+        # Imported here since shared memory is not available in the browser
+        from multiprocessing import shared_memory
+        self.memory = shared_memory.SharedMemory(create=True, size=SharedState.size())
+        self.shared = SharedState(self.memory.buf)
+        self.shared.control[:] = 0
+        self.shared.states[:] = 0
+        self.shared.commands.indices[:] = 0
+        self.shared.events.indices[:] = 0
+        # Start a fresh interpreter rather than a copy of this one and its window
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(target=run, args=(self.memory.name,), daemon=True)
+        self.sprites = np.zeros(0, SPRITE)
+        self.state = dict.fromkeys(STATE_FIELDS, 0)
+        self.renderer = SpriteRenderer()
+
+    def start(self):
+        """Starts the simulation process and waits for its first frame.
+        Stops it and releases the shared memory if it fails to start."""
+        try:
+            self.process.start()
+            while not self.shared.control[1:3].any():
+                if not self.process.is_alive():
+                    raise RuntimeError('simulation process exited while starting')
+                time.sleep(POLL_RATE)
+        except BaseException:
+            self.stop()
+            raise
+        self.sprites, self.state = self.shared.read()
+
+    def stop(self):
+        """Stops the simulation process, asking it to quit first, and
+        releases the shared memory once it has exited."""
+        if self.memory is None:
+            return
+        if self.process.is_alive():
+            self.send(QUIT)
+            self.process.join(STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        del self.shared
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+    @property
+    def alive(self):
+        """Whether the player is alive."""
+        return bool(self.state['alive'])
+
+    @property
+    def dropped_events(self):
+        """The number of sounds and particle emissions dropped because they
+        were not taken before their queue filled up."""
+        return self.shared.events.dropped
+
+    def send(self, command):
+        """Sends a command to the simulation, waiting for room in the queue
+        if the simulation has fallen behind taking them."""
+        while not self.shared.commands.put(command):
+            if not self.process.is_alive():
+                return
+            time.sleep(POLL_RATE)
+
+    def send_keys(self, keystate):
+        """Shares the movement keys held down."""
+        self.shared.control[3] = replay.encode_keys(keystate)
+
+    def update(self):
+        """Takes the latest frame. Returns the events sent since the last update."""
+        self.sprites, self.state = self.shared.read()
+        return self.shared.events.take()
+
+    def draw(self, surface):
+        """Draws the sprites of the latest frame onto a surface."""
+        self.renderer.draw(surface, self.sprites)
+
+
+class EmissionRecorder():
+    """Stands in for the particle system in the simulation process,
+    sending the particles emitted to the main process to draw"""
+
+    def __init__(self, events, colors):
+        self.events = events
+        self.colors = colors
+
+    def emit(self, x, y, count, speed, life, color, direction=0.0, spread=2 * math.pi):
+        self.events.offer((PARTICLES, self.colors.index(color), count, x, y, speed, life,
+                direction, spread))
+
+    def update(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def reseed(self, seed=None):
+        pass
+
+
+class SpriteRenderer():
+    """Draws the sprites published by the simulation process, caching
+    their transformed images in a cache of fixed size"""
+
+    def __init__(self):
+        self.cache = collections.OrderedDict()
+
+    def draw(self, surface, sprites):
+        """Draws the sprites of a frame onto a surface in a single batch."""
+        sequence = []
+        for code, index, x, y, rotation, scale in sprites.tolist():
+            image = self.image(code, index, rotation, scale)
+            sequence.append((image, image.get_rect(center=(x, y))))
+        surface.blits(sequence, False)
+
+    def image(self, code, index, rotation, scale):
+        """Returns the image of a sprite, transforming it only if it was not
+        drawn recently."""
+        # Rounding to coarse steps keeps the number of images drawn small
+        key = (code, index, round(rotation * ROTATION_STEPS / 360) % ROTATION_STEPS,
+                round(scale * SCALE_STEPS))
+        image = self.cache.get(key)
+        if image is not None:
+            self.cache.move_to_end(key)
+            return image
+        image = TYPES[code].images[index]
+        if key[3] != SCALE_STEPS:
+            image = pg.transform.scale_by(image, key[3] / SCALE_STEPS)
+        if key[2]:
+            image = pg.transform.rotate(image, key[2] * 360 / ROTATION_STEPS)
+        self.cache[key] = image
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return image
+
+
+def run(name):
+    """Runs the simulation until told to quit. This is the entry point of the
+    simulation process."""
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    # Leave SIGTERM and SIGINT to Python, so that the process can be terminated
+    os.environ['SDL_NO_SIGNAL_HANDLERS'] = '1'
+    # Log memory use to a file of its own, which the main process does not hold open
+    if os.environ.get('MEMORY_LOG'):
+        os.environ['MEMORY_LOG'] += '.simulation'
+    from multiprocessing import shared_memory
+    import main as game
+    memory = shared_memory.SharedMemory(name=name)
+    shared = SharedState(memory.buf)
+    game.init_game(headless=True)
+    game.particle_system = EmissionRecorder(shared.events, game.PARTICLE_COLORS)
+
+    paused = False
+    quicksave = None
+    period = 1 / game.FPS
+    deadline = time.perf_counter()
+    while True:
+        # Note when the input was read, which latency is measured against
+        input_time = time.perf_counter_ns()
+
+        # Handle commands
+        commands = shared.commands.take().tolist()
+        for command in commands:
+            alive = game.player.alive()
+            if command == QUIT:
+                game.memory.stop()
+                del shared
+                memory.close()
+                return
+            elif command == SHOOT and alive and not paused and game.ammo > 0:
+                game.shoot()
+            elif command == PAUSE and alive:
+                paused = True
+            elif command == RESUME:
+                paused = False
+            elif command == NEW_GAME and not alive:
+                game.new_game()
+            elif command == SAVE and alive:
+                quicksave = game.capture_world()
+            elif command == LOAD and quicksave is not None:
+                game.restore_world(quicksave)
+            elif command == REWIND and len(game.snapshots) > 0:
+                game.restore_world(game.snapshots.pop())
+
+        # Advance the game
+        playing = game.player.alive() and not paused
+        if playing:
+            game.keystate = replay.decode_keys(int(shared.control[3]))
+            game.simulate_tick()
+        while not game.sound_queue.empty():
+            shared.events.offer((SOUND, game.sounds.index(game.sound_queue.get_nowait()), 0, 0, 0, 0, 0, 0, 0))
+        # Nothing changes while paused or game over until a command arrives
+        if playing or commands:
+            shared.publish(sprite_records(game.sprites), (game.score, game.player.alive(), input_time))
+
+        # Check for commands less often while paused or game over
+        if not playing:
+            time.sleep(game.IDLE_POLL_RATE)
+            deadline = time.perf_counter()
+            continue
+
+        # Wait for the next tick, dropping ticks if too far behind
+        deadline += period
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -MAX_LAG:
+            deadline = time.perf_counter()
+
+def sprite_records(sprites):
+    """Returns the type, image, position, rotation and scale of each sprite to draw."""
+    records = []
+    for sprite in sprites:
+        clazz = type(sprite)
+        if clazz is spaceship.Spaceship:
+            rotation = -90.0 - sprite.velocity.direction
+            scale = 1.0
+        elif clazz is spaceship.Exhaust:
+            rotation = -90.0 - sprite.spaceship.velocity.direction
+            scale = max(sprite.spaceship.velocity.magnitude / spaceship.FORWARD_MAX_SPEED, 0)
+        elif clazz is spaceship.Laser:
+            rotation = -90.0 - math.degrees(sprite.angle)
+            scale = 1.0
+        elif sprite.detail == obstacle.DETAIL_LOW:
+            continue
+        else:
+            rotation = sprite.rotation
+            scale = 1.0
+        x, y = sprite.rect.center
+        records.append((CODES[clazz], getattr(sprite, 'image_index', 0), x, y, rotation, scale))
+    return records
+
+def align(size):
+    """Rounds a size up to a multiple of 8 bytes."""
+    return (size + 7) // 8 * 8